@@ -0,0 +1,182 @@
+import os
+import time
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import rate_limiter
+import response_archive
+import response_cache
+from property_parser import loads
+
+# Load environment variables from .env file
+load_dotenv()
+
+STATE = "ca"
+if os.environ.get("STATE") is not None:
+    STATE = os.environ.get("STATE")
+
+# ZILLOW_API_BASEURL points the scripts at another server, e.g. mock_server.py.
+API_BASEURL = os.environ.get(
+    "ZILLOW_API_BASEURL", "https://zillow-com1.p.rapidapi.com"
+)
+
+RAPIDAPI_HOST = "zillow-com1.p.rapidapi.com"
+
+
+def apiHeaders():
+    """
+    RapidAPI request headers. The key is only checked when a request is
+    made, so --help, rebuilds and cached runs work without credentials.
+    """
+    apiKey = os.environ.get("X_RAPIDAPI_KEY")
+    if apiKey is None:
+        raise Exception("Envionment variable X_RAPIDAPI_KEY is not set")
+    return {"X-RapidAPI-Key": apiKey, "X-RapidAPI-Host": RAPIDAPI_HOST}
+
+
+# (connect, read) timeouts in seconds.
+TIMEOUT = (5, 30)
+# Enough keep-alive connections for the default --concurrency on both the
+# RapidAPI host and the image CDN.
+DEFAULT_POOL_SIZE = 16
+# Only retry failures where the request never got an answer (connection
+# resets, dropped reads); HTTP status handling is left to the callers.
+RETRY = Retry(
+    total=3,
+    connect=3,
+    read=3,
+    status=0,
+    backoff_factor=0.5,
+    allowed_methods=["GET", "HEAD"],
+    raise_on_status=False,
+)
+
+
+# Attempts of a request answered with 429 or a 5xx before giving up.
+MAX_ATTEMPTS = 6
+
+
+class ApiError(Exception):
+    """The API kept answering 429 or 5xx for a request."""
+
+    def __init__(self, path, status, body):
+        super().__init__(f"GET {path} failed with {status} after retries: {body[:200]}")
+        self.path = path
+        self.status = status
+
+
+# Key every usable response of an endpoint has. The API also answers some
+# errors with a 200 and a message, those are neither cached nor archived.
+EXPECTED_KEYS = {
+    "/propertyExtendedSearch": "props",
+    "/property": "address",
+    "/images": "images",
+}
+
+
+def isUsable(path, responseJson):
+    key = EXPECTED_KEYS.get(path)
+    return isinstance(responseJson, dict) and (key is None or key in responseJson)
+
+
+# Called with every requests.Response, e.g. by benchmark.py to time requests.
+RESPONSE_HOOKS = []
+
+
+def createSession(poolSize=DEFAULT_POOL_SIZE):
+    session = requests.Session()
+    session.hooks["response"].append(_runResponseHooks)
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=poolSize, max_retries=RETRY
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _runResponseHooks(response, *args, **kwargs):
+    for hook in RESPONSE_HOOKS:
+        hook(response)
+
+
+_session = createSession()
+_poolSize = DEFAULT_POOL_SIZE
+
+
+def configure(poolSize):
+    """
+    Resize the connection pool, e.g. to match --concurrency; an unchanged
+    size keeps its open connections.
+    """
+    global _session, _poolSize
+    poolSize = max(poolSize, DEFAULT_POOL_SIZE)
+    if poolSize == _poolSize:
+        return
+    _session.close()
+    _session = createSession(poolSize)
+    _poolSize = poolSize
+
+
+def getJson(path, params):
+    """
+    GET a RapidAPI Zillow endpoint and return its JSON, served from the
+    response cache when fresh.
+    """
+    if response_cache.enabled():
+        cached = response_cache.get(path, params)
+        # Entries cached before the shape check may be error payloads.
+        if cached is not None and isUsable(path, cached):
+            metrics.observeCacheHit(path)
+            return cached
+    headers = apiHeaders()
+    for attempt in range(MAX_ATTEMPTS):
+        with metrics.stage("rate_limit_wait"):
+            rate_limiter.acquire()
+        try:
+            response = _session.get(
+                f"{API_BASEURL}{path}", headers=headers, params=params, timeout=TIMEOUT
+            )
+        except requests.RequestException:
+            metrics.observeError(path)
+            raise
+        metrics.observeResponse(path, response)
+        retryAfter = rate_limiter.onResponse(response.status_code, response.headers)
+        if response.status_code != 429 and response.status_code < 500:
+            break
+        if attempt == MAX_ATTEMPTS - 1:
+            raise ApiError(path, response.status_code, response.text)
+        if retryAfter is None:
+            # With Retry-After the limiter already pauses every worker.
+            with metrics.stage("backoff_wait"):
+                time.sleep(rate_limiter.backoffDelay(attempt))
+    with metrics.stage("decode"):
+        # Decoded once; the cache and the archive keep the same text.
+        body = response.text
+        responseJson = loads(body)
+    if response.status_code == 200 and isUsable(path, responseJson):
+        response_cache.store(path, params, body)
+        response_archive.append(path, params, body, responseJson)
+    return responseJson
+
+
+def download(url, **kwargs):
+    """Streaming GET for non-API resources such as listing photos."""
+    try:
+        response = _session.get(url, stream=True, timeout=TIMEOUT, **kwargs)
+    except requests.RequestException:
+        metrics.observeError("download")
+        raise
+    # The body is not read yet; count what the server announced.
+    size = int(response.headers.get("Content-Length", 0))
+    metrics.observeResponse("download", response, size)
+    return response
+
+
+def head(url):
+    response = _session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    metrics.observeResponse("head", response, 0)
+    return response
@@ -0,0 +1,267 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock_server
+from metrics import percentile
+
+SCENARIOS = ["basic", "advanced", "detail", "mark"]
+DEFAULT_CITIES = "Fremont,Newark,Union City"
+
+
+class LatencyRecorder:
+    """api_client response hook collecting per-request latency."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statusCounts = {}
+
+    def __call__(self, response):
+        with self.lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            self.statusCounts[response.status_code] = (
+                self.statusCounts.get(response.status_code, 0) + 1
+            )
+
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+            self.statusCounts = {}
+
+
+def countCsvRows(csvFile):
+    with open(csvFile, encoding="utf-8") as file:
+        return max(0, sum(1 for _ in file) - 1)
+
+
+def runScenario(name, args, zpids):
+    # Imported here so ZILLOW_API_BASEURL is set before api_client loads.
+    import get_detail_data
+    import get_zillow_data
+    import mark_houses
+    import response_archive
+    import response_cache
+
+    response_cache.configure(enabled=False)
+    response_archive.configure(enabled=False)
+    commonArgs = dict(
+        concurrency=args.concurrency,
+        rps=args.rps,
+        quota_reserve=0,
+        max_quota_wait=0,
+        cache_dir=response_cache.DEFAULT_CACHE_DIR,
+        no_cache=True,
+        archive_dir=response_archive.ARCHIVE_DIR,
+        no_archive=True,
+        metrics_dir="metrics",
+        no_metrics=True,
+        profile=False,
+        resume=False,
+        budget=None,
+        refresh_state="refresh.sqlite",
+        registry="marked.sqlite",
+        # Always hit the API so every run measures the same requests.
+        max_age_hours=0,
+    )
+    if name == "basic":
+        outputFile = get_zillow_data.getBasicData(
+            args.cities, "ForSale", 7, args.concurrency
+        )
+        return countCsvRows(outputFile)
+    if name == "advanced":
+        outputFile = get_zillow_data.getForSaleData(args.cities, args.concurrency)
+        return countCsvRows(outputFile)
+    if name == "detail":
+        with open("marked.csv", "w") as file:
+            file.write("zpid,date\n")
+            file.writelines(f"{zpid},231001\n" for zpid in zpids)
+        get_detail_data.main(argparse.Namespace(config="marked.csv", **commonArgs))
+        detailFiles = [f for f in os.listdir(".") if f.startswith("detail_")]
+        return countCsvRows(detailFiles[0])
+    if name == "mark":
+        mark_houses.main(argparse.Namespace(zpids=",".join(zpids), **commonArgs))
+        return len(zpids)
+    raise ValueError(f"Unknown scenario {name}")
+
+
+# Prints the heavy modules loaded by building a command's parser.
+STARTUP_PROBE = """
+import sys, dreamhouse
+dreamhouse.commandParser(sys.argv[1]) if len(sys.argv) > 1 else dreamhouse.buildParser()
+print(",".join(dreamhouse.loadedHeavyModules()))
+"""
+
+
+def measureStartup(runs):
+    """
+    Median wall time of `dreamhouse.py [command] --help` in fresh
+    interpreters, and the heavy modules each command's parser pulls in.
+    """
+    import dreamhouse
+
+    scriptDir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": scriptDir}
+    env.pop("X_RAPIDAPI_KEY", None)
+    commands = [([], "(none)", dreamhouse.STARTUP_BUDGET_MS, ())] + [
+        ([name], name, command.startupBudgetMs, command.heavyImports)
+        for name, command in dreamhouse.COMMANDS.items()
+    ]
+    results = []
+    # The scripts create their log files in the working directory.
+    with tempfile.TemporaryDirectory() as workDir:
+        for nameArgs, label, budgetMs, allowed in commands:
+            argv = [sys.executable, os.path.join(scriptDir, "dreamhouse.py")]
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run(
+                    argv + nameArgs + ["--help"],
+                    cwd=workDir,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                times.append(time.perf_counter() - start)
+            loaded = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE] + nameArgs,
+                cwd=workDir,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+            unexpected = [
+                module
+                for module in (loaded[0].split(",") if loaded else [])
+                if module not in allowed
+            ]
+            ms = round(1000 * percentile(times, 50), 1)
+            results.append(
+                {
+                    "command": label,
+                    "ms": ms,
+                    "budgetMs": budgetMs,
+                    "unexpectedImports": unexpected,
+                    "ok": ms <= budgetMs and not unexpected,
+                }
+            )
+    return results
+
+
+def startup(args):
+    results = measureStartup(args.startup_runs)
+    print(f"{'command':<10}{'ms':>9}{'budget':>9}  unexpected imports")
+    for result in results:
+        print(
+            f"{result['command']:<10}{result['ms']:>9}{result['budgetMs']:>9}  "
+            + (",".join(result["unexpectedImports"]) or "-")
+            + ("" if result["ok"] else "  OVER BUDGET")
+        )
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+        print(f"{args.json} is created.")
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+def main(args):
+    if args.startup:
+        startup(args)
+        return
+    config = mock_server.configFromArgs(args)
+    fixtures = mock_server.Fixtures(args.fixtures, args.seed_csv)
+    server = mock_server.startServer(fixtures, config)
+    os.environ["ZILLOW_API_BASEURL"] = server.baseUrl
+    os.environ.setdefault("X_RAPIDAPI_KEY", "benchmark")
+
+    import api_client
+    import get_zillow_data  # noqa: F401, sets up my_logger
+    import rate_limiter
+
+    recorder = LatencyRecorder()
+    api_client.RESPONSE_HOOKS.append(recorder)
+    rate_limiter.configure(args.rps)
+    api_client.configure(args.concurrency)
+    logging.getLogger("my_logger").setLevel(logging.WARNING)
+
+    zpids = [str(prop["zpid"]) for prop in fixtures.props[: args.houses]]
+    startDir = os.getcwd()
+    results = []
+    for name in args.scenarios.split(","):
+        recorder.reset()
+        with tempfile.TemporaryDirectory() as workDir:
+            os.chdir(workDir)
+            try:
+                start = time.perf_counter()
+                listings = runScenario(name, args, zpids)
+                elapsed = time.perf_counter() - start
+            finally:
+                os.chdir(startDir)
+        requests = len(recorder.latencies)
+        results.append(
+            {
+                "scenario": name,
+                "seconds": round(elapsed, 3),
+                "listings": listings,
+                "requests": requests,
+                "listingsPerSec": round(listings / elapsed, 2),
+                "requestsPerSec": round(requests / elapsed, 2),
+                "p50Ms": round(1000 * percentile(recorder.latencies, 50), 1),
+                "p99Ms": round(1000 * percentile(recorder.latencies, 99), 1),
+                "statusCounts": dict(recorder.statusCounts),
+            }
+        )
+    server.shutdown()
+
+    print(
+        f"{'scenario':<10}{'seconds':>9}{'listings':>10}{'requests':>10}"
+        + f"{'list/s':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<10}{result['seconds']:>9}{result['listings']:>10}"
+            + f"{result['requests']:>10}{result['listingsPerSec']:>9}"
+            + f"{result['requestsPerSec']:>9}{result['p50Ms']:>9}{result['p99Ms']:>9}"
+        )
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+        print(f"{args.json} is created.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Crawl throughput benchmark against a local mock Zillow API"
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"comma separated subset of {SCENARIOS}",
+    )
+    parser.add_argument("--cities", default=DEFAULT_CITIES)
+    parser.add_argument(
+        "--houses", type=int, default=20, help="zpids used by detail and mark"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=1000.0)
+    parser.add_argument("--json", help="also write the results to this json file")
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="instead of crawling, measure the cold start of every dreamhouse.py "
+        + "command against its budget; exit 1 when one is over",
+    )
+    parser.add_argument(
+        "--startup-runs", type=int, default=5, help="interpreter starts per command"
+    )
+    mock_server.addMockArgs(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,109 @@
+import functools
+import json
+import os
+import re
+import threading
+
+JOURNAL_DIR = ".journal"
+
+
+class CrawlJournal:
+    """
+    Append-only JSONL log of completed API work (search pages, parsed detail
+    rows) so that an interrupted crawl can be resumed without repeating any
+    call. A journal with no path records nothing.
+    """
+
+    def __init__(self, path=None, resume=False):
+        self.path = path
+        self.resume = resume
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.file = None
+        if path is not None and resume and os.path.isfile(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short if the run was killed.
+                    continue
+                self.entries[(entry["kind"], entry["key"])] = entry["value"]
+
+    def lookupOrRecord(self, kind, key, fetch):
+        with self.lock:
+            if (kind, key) in self.entries:
+                return self.entries[(kind, key)]
+        value = fetch()
+        if self.path is not None:
+            line = json.dumps({"kind": kind, "key": key, "value": value})
+            with self.lock:
+                self.entries[(kind, key)] = value
+                self._open().write(line + "\n")
+                self.file.flush()
+        return value
+
+    def _open(self):
+        # Opened on first write so runs that fetch nothing leave no file behind.
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(
+                self.path, "a" if self.resume else "w", encoding="utf-8"
+            )
+        return self.file
+
+    def resumedCount(self):
+        return len(self.entries)
+
+    def close(self):
+        """Close the file, keeping the journal for a later --resume."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def finish(self):
+        """Drop the journal once its run has completed successfully."""
+        self.close()
+        if self.path is not None and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+_journal = CrawlJournal()
+
+
+def journalPath(name):
+    return os.path.join(JOURNAL_DIR, re.sub(r"[^\w.-]+", "_", name) + ".jsonl")
+
+
+def configure(name, resume=False):
+    global _journal
+    _journal = CrawlJournal(journalPath(name), resume)
+    return _journal
+
+
+def finish():
+    _journal.finish()
+
+
+def journaled(kind, keyFn=str):
+    """Decorator that serves a single-argument fetch function from the journal."""
+
+    def decorator(fetchFn):
+        @functools.wraps(fetchFn)
+        def wrapper(arg):
+            return _journal.lookupOrRecord(kind, keyFn(arg), lambda: fetchFn(arg))
+
+        return wrapper
+
+    return decorator
+
+
+def addResumeArgs(parser):
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last interrupted run without repeating its API calls",
+    )
@@ -1,5 +1,7 @@
 export PYTHONPATH=/Library/Frameworks/Python.framework/Versions/3.10/lib/python3.10:/Library/Frameworks/Python.framework/Versions/3.10/lib/python3.10/lib-dyn2load:/Library/Frameworks/Python.framework/Versions/3.10/lib/python3.10/site-packages
 cd /Users/feini/dreamhouse/python
-/usr/local/bin/python3 get_zillow_data.py --cities 'Fremont,Newark,Union City' --status ForSale --mode advanced --upload
-/usr/local/bin/python3 forsale_summary.py
-
+# The same pipeline as the jobs of daemon.json; run either this from cron or
+# `dreamhouse.py daemon`, not both.
+/usr/local/bin/python3 dreamhouse.py \
+    search --cities 'Fremont,Newark,Union City' --status ForSale --mode advanced --upload \
+    + summary
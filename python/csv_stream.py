@@ -0,0 +1,81 @@
+import csv
+import os
+
+DEFAULT_FLUSH_EVERY = 100
+
+
+class CsvStreamWriter:
+    """
+    Write rows to a CSV file as they are produced.
+
+    The header is fixed up front, so dict rows with missing keys get empty
+    cells and unknown keys are dropped instead of breaking the file. Tuple
+    and list rows (e.g. property_parser records) are written as they are
+    and must already be in fieldnames order. The file is
+    flushed every flushEvery rows so partial output is readable while a
+    crawl is still running.
+
+    With atomic, rows go to a "<csv_filename>.part" file that replaces
+    csv_filename only once every row is written, for output that is also
+    read as an input (the forsale snapshot carries its rows forward).
+    """
+
+    def __init__(
+        self, csv_filename, fieldnames, flushEvery=DEFAULT_FLUSH_EVERY, atomic=False
+    ):
+        self.csv_filename = csv_filename
+        self.fieldnames = list(fieldnames)
+        self.flushEvery = flushEvery
+        self.atomic = atomic
+        self.path = f"{csv_filename}.part" if atomic else csv_filename
+        self.rowCount = 0
+        self.file = None
+        self.writer = None
+        self.tupleWriter = None
+
+    def __enter__(self):
+        self.file = open(self.path, mode="w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(
+            self.file, fieldnames=self.fieldnames, restval="", extrasaction="ignore"
+        )
+        self.tupleWriter = csv.writer(self.file)
+        self.writer.writeheader()
+        self.file.flush()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if self.atomic:
+            if exc_type is None:
+                os.replace(self.path, self.csv_filename)
+            else:
+                os.remove(self.path)
+
+    def writeRow(self, row):
+        if isinstance(row, (tuple, list)):
+            self.tupleWriter.writerow(row)
+        else:
+            self.writer.writerow(row)
+        self.rowCount += 1
+        if self.rowCount % self.flushEvery == 0:
+            self.file.flush()
+
+    def writeRows(self, rows):
+        for row in rows:
+            self.writeRow(row)
+
+    def writeColumns(self, columns):
+        """Write a batch given as {fieldname: list of values}, all of one length."""
+        rows = list(zip(*(columns[name] for name in self.fieldnames)))
+        self.tupleWriter.writerows(rows)
+        self.rowCount += len(rows)
+        self.file.flush()
+
+
+def writeCsvStream(
+    rows, csv_filename, fieldnames, flushEvery=DEFAULT_FLUSH_EVERY, atomic=False
+):
+    """Drain an iterable of rows into csv_filename and return the row count."""
+    with CsvStreamWriter(csv_filename, fieldnames, flushEvery, atomic) as writer:
+        writer.writeRows(rows)
+    return writer.rowCount
@@ -0,0 +1,161 @@
+"""
+One entry point for the crawler scripts:
+
+    python dreamhouse.py search --cities Fremont --mode advanced --incremental
+    python dreamhouse.py search --cities Fremont --mode advanced + summary + diff
+
+Only the chosen command's module is imported, so `--help` and the light
+commands never load pandas, pyarrow or google-cloud-storage. Commands
+joined with "+" run one after another in the same interpreter.
+"""
+import argparse
+import importlib
+import sys
+from typing import NamedTuple, Tuple
+
+import rate_limiter
+
+COMMAND_SEPARATOR = "+"
+
+
+class Command(NamedTuple):
+    module: str
+    help: str
+    # Wall time budget of `dreamhouse.py <command> --help` in a fresh
+    # interpreter, checked by `benchmark.py --startup`.
+    startupBudgetMs: int
+    # Heavy modules the command may import just to build its parser.
+    heavyImports: Tuple[str, ...] = ()
+    # What the command needs to itself when run by the scheduler daemon;
+    # jobs sharing a resource never run at the same time. The process-wide
+    # state of a command's modules is a resource too: "api" covers the API
+    # client, limiter, journal and metrics, "log" the file handlers
+    # script_log.logsTo adds to my_logger, "profile" the profiler's tracer
+    # and "upload" the configured uploader.
+    resources: Tuple[str, ...] = ()
+
+
+PANDAS = ("pandas", "numpy", "pyarrow")
+COMMANDS = {
+    "search": Command(
+        "get_zillow_data",
+        "crawl search results, with details in advanced mode",
+        300,
+        resources=("api", "forsale_csv", "log", "profile", "upload"),
+    ),
+    "detail": Command(
+        "get_detail_data",
+        "fetch details of the marked houses",
+        300,
+        resources=("api", "registry", "profile"),
+    ),
+    "marked": Command(
+        "get_marked_data",
+        "refresh details of every registered house",
+        300,
+        resources=("api", "registry", "profile"),
+    ),
+    "mark": Command(
+        "mark_houses",
+        "mark houses, saving their photos and detail",
+        300,
+        resources=("api", "registry", "profile"),
+    ),
+    "summary": Command(
+        "forsale_summary",
+        "summarize the forsale snapshots and upload the summary",
+        1000,
+        PANDAS,
+        ("forsale_csv", "log", "profile", "upload"),
+    ),
+    "diff": Command(
+        "snapshot_diff",
+        "diff consecutive forsale snapshots",
+        1000,
+        PANDAS,
+        ("forsale_csv",),
+    ),
+    "regions": Command(
+        "region_crawl",
+        "crawl the cities of several states on a pool of processes",
+        300,
+        resources=("api", "log"),
+    ),
+    "upload": Command(
+        "uploader",
+        "upload files to GCS or a local directory",
+        150,
+        resources=("log", "profile", "upload"),
+    ),
+    "daemon": Command(
+        "scheduler_daemon", "run jobs on their schedules in one long-lived process", 250
+    ),
+}
+# Budget of `dreamhouse.py --help`, which imports no command module.
+STARTUP_BUDGET_MS = 150
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "google.cloud.storage"]
+
+
+def loadedHeavyModules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(
+        prog="dreamhouse",
+        description="Zillow crawler and snapshot tools",
+        epilog=f'Join commands with " {COMMAND_SEPARATOR} " to run them in one process.',
+    )
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for name, command in COMMANDS.items():
+        # The command's own options are parsed by commandParser, which is
+        # only built for the command being run.
+        commands.add_parser(name, help=command.help, add_help=False)
+    return parser
+
+
+def commandParser(name):
+    """Import the module of a command and return (module, its argument parser)."""
+    command = COMMANDS[name]
+    module = importlib.import_module(command.module)
+    parser = argparse.ArgumentParser(prog=f"dreamhouse {name}", description=command.help)
+    module.addArgs(parser)
+    return module, parser
+
+
+def splitCommands(argv):
+    """Split argv on COMMAND_SEPARATOR into the argv of each command."""
+    chunks = [[]]
+    for arg in argv:
+        if arg == COMMAND_SEPARATOR:
+            chunks.append([])
+        else:
+            chunks[-1].append(arg)
+    return chunks
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Every command line is checked before the first command starts.
+    runs = []
+    for commandArgv in splitCommands(argv):
+        args, rest = buildParser().parse_known_args(commandArgv)
+        module, parser = commandParser(args.command)
+        runs.append((module, parser.parse_args(rest)))
+    for module, args in runs:
+        module.main(args)
+        if getattr(args, "profile", False):
+            # Write this command's trace before the next one starts; profiler
+            # is already imported by the command that took --profile.
+            import profiler
+
+            profiler.finish()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except rate_limiter.QuotaExhausted as e:
+        # Crawl journals and the marked registry keep what was fetched so far.
+        print(f"Stopped, API quota exhausted: {e}; rerun once it resets")
+        sys.exit(2)
@@ -0,0 +1,52 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import rate_limiter
+
+DEFAULT_CONCURRENCY = 4
+
+
+def fetchConcurrently(fetchFn, items, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Call fetchFn for every item on a thread pool and return the results
+    in the same order as items.
+
+    Rate limiting is left to fetchFn (see rate_limiter.acquire), so the
+    pool size only bounds how many requests are in flight at once.
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [fetchFn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(fetchFn, items))
+
+
+def fetchStream(fetchFn, items, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Like fetchConcurrently, but consume items lazily and yield results in
+    order as they arrive, keeping at most 2 * concurrency calls queued so
+    memory does not grow with the number of items.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield fetchFn(item)
+        return
+    window = 2 * concurrency
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fetchFn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def addConcurrencyArgs(parser):
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="max number of API requests in flight",
+    )
+    rate_limiter.addRateArgs(parser)
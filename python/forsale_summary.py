@@ -1,69 +1,100 @@
 import pandas as pd
 import re
 import os
+import pickle
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import argparse
-from google.cloud import storage
 from dotenv import load_dotenv
-import logging
 
-BUCKET_NAME = "dreamhome1029"
+import profiler
+import script_log
+import snapshot_store
+import uploader
+
 # The date in filename doesn't mean anything, will rename it later.
 DESTINATION_BLOB_NAME = "overall_summary_forsale.csv"
+# Per-snapshot summaries from previous runs, see load_summary_cache.
+SUMMARY_CACHE_FILE = ".cache/forsale_summary.pkl"
 
 
-logger = logging.getLogger("my_logger")
-logger.setLevel(logging.DEBUG)  # Set logger level
+logger = script_log.getLogger()
 
-# Create a file handler and set its level to DEBUG
-file_handler = logging.FileHandler("get_zillow_summary.log")
-file_handler.setLevel(logging.DEBUG)
 
-# Create a console handler and set its level to DEBUG
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+load_dotenv()
 
-# Create a formatter and set it for both handlers
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+def load_summary_cache(cache_file):
+    """Return {csv path: (mtime_ns, size, summary_df)} saved by the last run."""
+    if cache_file is None or not os.path.isfile(cache_file):
+        return {}
+    try:
+        with open(cache_file, "rb") as fp:
+            return pickle.load(fp)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        logger.warning(f"ignore unreadable summary cache {cache_file}")
+        return {}
 
-# Add both handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
+def save_summary_cache(cache, cache_file):
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "wb") as fp:
+        pickle.dump(cache, fp)
+    os.replace(tmp_file, cache_file)
 
-load_dotenv()
 
-def uploadBlob(source_file_name):
-    """Uploads a file to the bucket."""
-    # Set the environment variable for authentication
-    # Create a client
-    storage_client = storage.Client()
-    # Get the bucket
-    bucket = storage_client.bucket(BUCKET_NAME)
+def summarize_file(csv_file):
+    """Process pool task: summarize one snapshot, returned as plain column lists."""
+    return get_summary_df(csv_file).to_dict("list")
 
-    # Create a blob and upload the file
-    blob = bucket.blob(DESTINATION_BLOB_NAME)
-    blob.upload_from_filename(source_file_name)
 
-    logger.info(
-        f"File {source_file_name} uploaded to gs://{BUCKET_NAME}/{DESTINATION_BLOB_NAME}."
-    )
+def summarize_files(csv_files, workers=1):
+    """Return {csv path: summary_df}, spread over `workers` processes."""
+    if workers <= 1 or len(csv_files) <= 1:
+        return {csv_file: get_summary_df(csv_file) for csv_file in csv_files}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        columns_list = executor.map(
+            summarize_file,
+            csv_files,
+            chunksize=max(1, len(csv_files) // (workers * 4)),
+        )
+        return {
+            csv_file: pd.DataFrame(columns)
+            for csv_file, columns in zip(csv_files, columns_list)
+        }
 
 
-def get_all_summary(csv_dir):
+def get_all_summary(csv_dir, cache_file=SUMMARY_CACHE_FILE, workers=1):
     files = os.listdir(csv_dir)
     # Filter files that start with 'forsale_'
-    forsale_files = [
-        file for file in files if file.startswith("forsale_") and file.endswith(".csv")
-    ]
+    forsale_files = sorted(
+        os.path.join(csv_dir, file)
+        for file in files
+        if file.startswith("forsale_") and file.endswith(".csv")
+    )
     print(forsale_files)
-    df = pd.DataFrame()
+    old_cache = load_summary_cache(cache_file)
+    stats = {
+        csv_file: (os.stat(csv_file).st_mtime_ns, os.stat(csv_file).st_size)
+        for csv_file in forsale_files
+    }
+    stale_files = [
+        csv_file
+        for csv_file in forsale_files
+        if csv_file not in old_cache or old_cache[csv_file][:2] != stats[csv_file]
+    ]
+    logger.info(f"summarize {len(stale_files)} of {len(forsale_files)} snapshots")
+    fresh = summarize_files(stale_files, workers)
+    # Rebuilt from scratch so summaries of deleted snapshots are dropped.
+    cache = {}
     for csv_file in forsale_files:
-        summary_df = get_summary_df(csv_file)
-        df = pd.concat([df, summary_df], ignore_index=True)
-    return df
+        summary_df = fresh[csv_file] if csv_file in fresh else old_cache[csv_file][2]
+        cache[csv_file] = (*stats[csv_file], summary_df)
+    if cache_file is not None:
+        save_summary_cache(cache, cache_file)
+    if not cache:
+        return pd.DataFrame()
+    return pd.concat([entry[2] for entry in cache.values()], ignore_index=True)
 
 
 def extract_date_from_filename(filename):
@@ -79,10 +110,48 @@ def extract_date_from_filename(filename):
         raise ValueError("No valid date found in filename.")
 
 
+def get_all_summary_from_store(store_dir):
+    # Only the columns the summary needs are read from the store.
+    with profiler.span("store_load"):
+        df = snapshot_store.loadSnapshots(
+            "forsale",
+            columns=["zipcode", "price", "datePosted", "collectedDate"],
+            storeDir=store_dir,
+        )
+    df["zipcode"] = df["zipcode"].astype(str)
+    df["collectedDate"] = pd.to_datetime(df["collectedDate"])
+    df["onMarketDays"] = (df["collectedDate"] - df["datePosted"]).dt.days
+
+    aggregations = dict(
+        median_price=("price", "median"),
+        count=("price", "count"),
+        onMarketDays=("onMarketDays", "median"),
+    )
+    with profiler.span("summary_groupby"):
+        summary_by_zipcode = (
+            df.groupby(["collectedDate", "zipcode"]).agg(**aggregations).reset_index()
+        )
+        overall_summary = (
+            df.groupby("collectedDate").agg(**aggregations).reset_index()
+        )
+    overall_summary["zipcode"] = "All"
+
+    # Same layout as concatenating get_summary_df over the csv files: each
+    # date's zipcode rows followed by its "All" row.
+    columns = ["zipcode", "median_price", "count", "onMarketDays", "collectedDate"]
+    summary = pd.concat([summary_by_zipcode, overall_summary], ignore_index=True)
+    summary["isOverall"] = summary["zipcode"] == "All"
+    summary = summary.sort_values(
+        ["collectedDate", "isOverall", "zipcode"], kind="stable"
+    )
+    return summary[columns].reset_index(drop=True)
+
+
 def get_summary_df(csv_file):
     # Make sure to replace 'your_file.csv' with the path to your actual CSV file
     # Read the CSV file into a DataFrame
-    df = pd.read_csv(csv_file)
+    with profiler.span("csv_read"):
+        df = pd.read_csv(csv_file)
     collectedDate = extract_date_from_filename(csv_file)
 
     df["datePosted"] = pd.to_datetime(df["datePosted"])
@@ -92,23 +161,24 @@ def get_summary_df(csv_file):
 
     df["price"] = df["price"].replace("[\$,]", "", regex=True).astype(float)
 
-    # Group by 'zipcode' and calculate median and count
-    summary_by_zipcode = (
-        df.groupby("zipcode")
-        .agg(
-            median_price=("price", "median"),
-            count=("price", "count"),
-            onMarketDays=("onMarketDays", "median"),
+    with profiler.span("summary_groupby"):
+        # Group by 'zipcode' and calculate median and count
+        summary_by_zipcode = (
+            df.groupby("zipcode")
+            .agg(
+                median_price=("price", "median"),
+                count=("price", "count"),
+                onMarketDays=("onMarketDays", "median"),
+            )
+            .reset_index()
         )
-        .reset_index()
-    )
 
-    summary_by_zipcode["collectedDate"] = df["collectedDate"].iloc[0]
+        # Calculate the overall median and total count for a new summary row
+        overall_median = df["price"].median()
+        total_count = df["price"].count()
+        onMarketDays = df["onMarketDays"].median()
 
-    # Calculate the overall median and total count for a new summary row
-    overall_median = df["price"].median()
-    total_count = df["price"].count()
-    onMarketDays = df["onMarketDays"].median()
+    summary_by_zipcode["collectedDate"] = df["collectedDate"].iloc[0]
 
     # Append the overall summary row to the DataFrame
     overall_summary = pd.DataFrame(
@@ -131,18 +201,56 @@ def get_summary_df(csv_file):
     return summary_by_zipcode
 
 
+@script_log.logsTo("get_zillow_summary.log")
 def main(args):
+    profiler.configureFromArgs(args, f"forsale_summary_{args.source}")
+    uploader.configureFromArgs(args)
     csv_dir = args.dir
-    df = get_all_summary(csv_dir)
-    df.to_csv(DESTINATION_BLOB_NAME, index=False)
+    with profiler.span("summarize", source=args.source):
+        if args.source == "store":
+            df = get_all_summary_from_store(args.store)
+        else:
+            cache_file = None if args.no_cache else args.cache_file
+            df = get_all_summary(csv_dir, cache_file, args.workers)
+    with profiler.span("csv_write"):
+        df.to_csv(DESTINATION_BLOB_NAME, index=False)
     print(f"{DESTINATION_BLOB_NAME} is created.")
-    uploadBlob(DESTINATION_BLOB_NAME)
+    uploader.uploadFiles([(DESTINATION_BLOB_NAME, DESTINATION_BLOB_NAME)])
+
+
+def addArgs(parser):
+    parser.add_argument("--dir", required=False, help="forsale csv dir", default=".")
+    parser.add_argument(
+        "--source",
+        default="csv",
+        choices=["csv", "store"],
+        help="read forsale_*.csv files or the columnar snapshot store",
+    )
+    parser.add_argument(
+        "--store", default=snapshot_store.STORE_DIR, help="snapshot store dir"
+    )
+    parser.add_argument(
+        "--cache-file",
+        default=SUMMARY_CACHE_FILE,
+        help="per-snapshot summary cache, only used with --source csv",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="summarize every snapshot again"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes used to summarize snapshots, only used with --source csv",
+    )
+    uploader.addUploadArgs(parser)
+    profiler.addProfileArgs(parser)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Get summary from a given forsale csv file"
     )
-    parser.add_argument("--dir", required=False, help="forsale csv dir", default=".")
+    addArgs(parser)
     args = parser.parse_args()
     main(args)
@@ -1,326 +1,380 @@
 import os
 import sys
 import argparse
-import requests
 import csv
 import json
 import re
-import pandas as pd
 from datetime import datetime
-import time
-from google.cloud import storage
-from dotenv import load_dotenv
-import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import api_client
+import crawl_journal
+import metrics
+import profiler
+import rate_limiter
+import refresh_scheduler
+import response_archive
+import response_cache
+import script_log
+import uploader
+from api_client import STATE
+from csv_stream import CsvStreamWriter, writeCsvStream
+from fetcher import addConcurrencyArgs, fetchStream
+from property_parser import (
+    DETAIL_FIELDS,
+    MISSING,
+    parseProperty,
+    pricePerFt,
+    searchRecord,
+)
+
+logger = script_log.getLogger()
 
-logger = logging.getLogger("my_logger")
-logger.setLevel(logging.DEBUG)  # Set logger level
 
-# Create a file handler and set its level to DEBUG
-file_handler = logging.FileHandler("get_zillow_data.log")
-file_handler.setLevel(logging.DEBUG)
+# The date in filename doesn't mean anything, will rename it later.
+DESTINATION_BLOB_NAME = "forsale_231028.csv"
 
-# Create a console handler and set its level to DEBUG
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+# Search result keys copied as-is into basic mode rows.
+SEARCH_KEYS = [
+    "price",
+    "zestimate",
+    "livingArea",
+    "lotAreaValue",
+    "zpid",
+    "rentZestimate",
+    "bedrooms",
+    "propertyType",
+    "address",
+]
+BASIC_FIELDS = SEARCH_KEYS + ["zipcode", "city", "dateSold", "pricePerFt"]
+
+
+@profiler.traced("detail_fetch")
+@crawl_journal.journaled("detail")
+def getDetailByZpid(zpid):
+    logger.info(f"getDetailByZpid {zpid}")
+    querystring = {"zpid": zpid}
+    responseJson = api_client.getJson("/property", querystring)
+    with metrics.stage("parse"):
+        return parseProperty(zpid, responseJson)
+
+
+SEARCH_PATH = "/propertyExtendedSearch"
+
+
+@profiler.traced("search_page")
+@crawl_journal.journaled("page", lambda query: json.dumps(query, sort_keys=True))
+def getSearchPage(query):
+    responseJson = api_client.getJson(SEARCH_PATH, query)
+    if "props" not in responseJson:
+        raise Exception(
+            f"Failed to GET {SEARCH_PATH}, please check your API token in .env. "
+            + f"{responseJson}"
+        )
+    return responseJson
+
+
+def searchAllPages(querystring, cities, concurrency, state=None):
+    """
+    Fetch every search result page of every city and yield them as
+    (city, props) in city order, then page order.
+
+    Page 1 of all cities is requested at once; as soon as a city's first
+    page reports totalPages, its remaining pages are queued on the same
+    pool. Request rate is bounded by the shared rate limiter. The cities
+    are searched in state, default STATE from .env.
+    """
+    state = state or STATE
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+
+        def searchCity(city):
+            queryWithPage = querystring.copy()
+            queryWithPage["location"] = f"{city}, {state}"
+            firstPage = getSearchPage({**queryWithPage, "page": 1})
+            totalPages = firstPage["totalPages"]
+            logger.debug(f"{city}: {totalPages} pages")
+            otherPages = [
+                executor.submit(getSearchPage, {**queryWithPage, "page": pageIdx})
+                for pageIdx in range(2, totalPages + 1)
+            ]
+            return firstPage, otherPages
 
-# Create a formatter and set it for both handlers
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+        cityFutures = [
+            (city, executor.submit(searchCity, city)) for city in cities.split(",")
+        ]
+        for city, cityFuture in cityFutures:
+            firstPage, otherPages = cityFuture.result()
+            yield city, firstPage["props"]
+            for pageFuture in otherPages:
+                yield city, pageFuture.result()["props"]
 
-# Add both handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
+def getBasicData(cities, statusType, days, concurrency):
+    querystring = {
+        "home_type": "Houses",
+        "bedsMin": 3,
+        "sort": "Price_High_Low",
+        "status_type": statusType,
+    }
+    if statusType == "RecentlySold":
+        querystring["soldInLast"] = days
 
-BUCKET_NAME = "dreamhome1029"
-# The date in filename doesn't mean anything, will rename it later.
-DESTINATION_BLOB_NAME = "forsale_231028.csv"
+    formatted_date = datetime.now().strftime("%y%m%d")
+    outputFile = f"{statusType.lower()}_{formatted_date}_basic.csv"
+    with profiler.span("search"):
+        pages = list(searchAllPages(querystring, cities, concurrency))
+    with profiler.span("parse"):
+        batches = list(basicBatches(pages))
+    with profiler.span("csv_write"):
+        rowCount = writeBasicCsv(batches, outputFile)
+    logger.info(f"{outputFile} is created with {rowCount} rows")
+    return outputFile
 
-# Load environment variables from .env file
-load_dotenv()
 
-if os.environ.get("X_RAPIDAPI_KEY") is None:
-    raise Exception("Envionment variable X_RAPIDAPI_KEY is not set")
+# Search pages are converted this many rows at a time; one page (41 props)
+# is too small a batch to win over a per-row loop.
+BASIC_BATCH_ROWS = 2000
 
-STATE = "ca"
-if os.environ.get("STATE") is not None:
-    STATE = os.environ.get("STATE")
 
-API_BASEURL = "https://zillow-com1.p.rapidapi.com"
-ZILLOW_BASEURL = "https://zillow.com"
+def localDates(epochMs):
+    """
+    "YYYY-MM-DD" local dates of an Arrow array of epoch milliseconds, ""
+    where missing. Sold dates repeat a lot, so each distinct value is
+    converted once and the results are taken back by index.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
 
-HEADERS = {
-    "X-RapidAPI-Key": os.environ.get("X_RAPIDAPI_KEY"),
-    "X-RapidAPI-Host": "zillow-com1.p.rapidapi.com",
+    encoded = pc.dictionary_encode(epochMs)
+    dates = pa.array(
+        [
+            datetime.fromtimestamp(ms / 1000).strftime("%Y-%m-%d")
+            for ms in encoded.dictionary.to_pylist()
+        ],
+        pa.string(),
+    )
+    return pc.fill_null(pc.take(dates, encoded.indices), "")
+
+
+def basicColumns(cities, props):
+    """
+    Basic mode rows of a batch of search results, as {field: values}; the
+    derived columns are computed with Arrow a column at a time. Search keys
+    keep their values as returned, keys missing from a prop (lotAreaValue
+    and livingArea often are) become empty cells.
+    """
+    # Imported here, the other modes never need it at startup.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = {key: [prop.get(key) for prop in props] for key in SEARCH_KEYS}
+    address = pa.array(columns["address"], pa.string())
+    zipcode = pc.struct_field(pc.extract_regex(address, r"\b(?P<zipcode>\d{5})$"), [0])
+    columns["zipcode"] = pc.fill_null(zipcode, "").to_pylist()
+    columns["city"] = cities
+    dateSold = pa.array([prop.get("dateSold") for prop in props], pa.float64())
+    columns["dateSold"] = localDates(dateSold).to_pylist()
+    # Same rule as property_parser.pricePerFt: MISSING without a price or area.
+    price = pa.array(columns["price"], pa.float64())
+    livingArea = pa.array(columns["livingArea"], pa.float64())
+    known = pc.and_(
+        pc.not_equal(pc.fill_null(price, 0), 0),
+        pc.not_equal(pc.fill_null(livingArea, 0), 0),
+    )
+    perFt = pc.round(pc.divide(price, pc.if_else(known, livingArea, None)), 2)
+    values = perFt.to_pylist()
+    for idx in pc.indices_nonzero(pc.invert(known)).to_pylist():
+        values[idx] = MISSING
+    columns["pricePerFt"] = values
+    return columns
+
+
+def basicBatches(pages):
+    """Yield (city, props) search pages as basicColumns of BASIC_BATCH_ROWS rows."""
+    cities, props = [], []
+    for city, pageProps in pages:
+        cities.extend([city] * len(pageProps))
+        props.extend(pageProps)
+        if len(props) >= BASIC_BATCH_ROWS:
+            with metrics.stage("parse"):
+                columns = basicColumns(cities, props)
+            # Yielded outside the stage, which must not time the consumer.
+            yield columns
+            cities, props = [], []
+    if props:
+        with metrics.stage("parse"):
+            columns = basicColumns(cities, props)
+        yield columns
+
+
+def writeBasicCsv(batches, outputFile):
+    """Write basicBatches as basic mode rows; return the row count."""
+    with CsvStreamWriter(outputFile, BASIC_FIELDS) as writer:
+        for columns in batches:
+            writer.writeColumns(columns)
+    return writer.rowCount
+
+
+# Search-level fields compared against the previous snapshot, as
+# {search result key: detail column}. A listing whose values all match is
+# carried forward instead of re-querying /property.
+CHANGE_FIELDS = {
+    "price": "price",
+    "zestimate": "zestimate",
+    "livingArea": "livingArea",
+    "bedrooms": "bedrooms",
+    "listingStatus": "homeStatus",
 }
 
 
-def uploadBlob(source_file_name):
-    """Uploads a file to the bucket."""
-    # Set the environment variable for authentication
-    # Create a client
-    storage_client = storage.Client()
-    # Get the bucket
-    bucket = storage_client.bucket(BUCKET_NAME)
-
-    # Create a blob and upload the file
-    blob = bucket.blob(DESTINATION_BLOB_NAME)
-    blob.upload_from_filename(source_file_name)
-
-    logger.info(
-        f"File {source_file_name} uploaded to gs://{BUCKET_NAME}/{DESTINATION_BLOB_NAME}."
+def findLatestSnapshot(directory="."):
+    snapshots = sorted(
+        file
+        for file in os.listdir(directory)
+        if re.fullmatch(r"forsale_\d{6}\.csv", file)
     )
+    return os.path.join(directory, snapshots[-1]) if snapshots else None
 
 
-def write_to_csv(json_content, csv_filename):
-    # Opening the file with write permission
-    with open(csv_filename, mode="w", newline="", encoding="utf-8") as file:
-        if isinstance(json_content, str):
-            json_content = json.loads(json_content)
-        if json_content:  # Check if json_content is not empty
-            header = json_content[0].keys()
-            writer = csv.DictWriter(file, fieldnames=header)
+def loadSnapshot(snapshotFile):
+    """Return the rows of a forsale snapshot keyed by zpid, values kept as written."""
+    with open(snapshotFile, newline="", encoding="utf-8") as file:
+        return {row["zpid"]: row for row in csv.DictReader(file)}
 
-            # Writing the header
-            writer.writeheader()
 
-            # Writing the rows
-            writer.writerows(json_content)
-            logger.info(f"{csv_filename} is created")
-        else:
-            logger.error("No data to write!")
+def _sameValue(searchValue, snapshotValue):
+    if searchValue is None or searchValue == "":
+        return snapshotValue in (None, "")
+    try:
+        return float(searchValue) == float(snapshotValue)
+    except (TypeError, ValueError):
+        return str(searchValue) == str(snapshotValue)
 
 
-def getZipCode(address):
-    # Search for a sequence of 5 digits in the address string.
-    match = re.search(r"\b\d{5}$", address)
-    # Return the matched string if found, otherwise return None.
-    return match.group(0) if match else ""
+def hasChanged(prop, snapshotRow):
+    return any(
+        not _sameValue(prop.get(searchKey), snapshotRow.get(column))
+        for searchKey, column in CHANGE_FIELDS.items()
+        if searchKey in prop
+    )
 
 
-def getDetailByZpid(zpid):
-    time.sleep(1)
-    logger.info(f"getDetailByZpid {zpid}")
-    url = f"{API_BASEURL}/property"
-    querystring = {"zpid": zpid}
-    response = requests.get(url, headers=HEADERS, params=querystring)
-    responseJson = response.json()
-    # print(responseJson)
-    addressInfo = responseJson["address"]
-    address = addressInfo["streetAddress"]
-    city = addressInfo["city"]
-    zipcode = addressInfo["zipcode"]
-    bedrooms = responseJson["bedrooms"]
-    datePosted = responseJson["datePosted"]
-    dateSold = responseJson["dateSold"]
-    livingArea = responseJson["livingArea"]
-    lotSize = responseJson["resoFacts"]["lotSize"]
-    stories = responseJson["resoFacts"]["stories"]
-    rentZestimate = responseJson["rentZestimate"]
-    propertyTaxRate = responseJson["propertyTaxRate"]
-    yearBuilt = responseJson["yearBuilt"]
-    zestimate = responseJson["zestimate"]
-    homeStatus = responseJson["homeStatus"]
-    price = responseJson["price"]
-    pricePerFt = -1
-    if livingArea != 0:
-        pricePerFt = round(price / livingArea, 2)
-    listingPrice = -1
-    historyEntries = responseJson["priceHistory"]
-    pathLink = responseJson["url"]
-    link = f"{ZILLOW_BASEURL}/{pathLink}"
-
-    schools = responseJson["schools"]
-    schoolsE = ""
-    schoolsM = ""
-    schoolsH = ""
-    for school in schools:
-        if school["level"] == "Elementary":
-            schoolsE = f"""{school["rating"]},{school["name"]}"""
-            continue
-        if school["level"] == "Middle":
-            schoolsM = f"""{school["rating"]},{school["name"]}"""
-            continue
-        if school["level"] == "High":
-            schoolsH = f"""{school["rating"]},{school["name"]}"""
-
-    for entry in historyEntries:
-        if entry["event"] == "Listed for sale":
-            listingPrice = entry["price"]
-            break
-    return {
-        "zpid": zpid,
-        "address": address,
-        "city": city,
-        "zipcode": zipcode,
-        "homeStatus": homeStatus,
-        "price": price,
-        "pricePerFt": pricePerFt,
-        "listingPrice": listingPrice,
-        "livingArea": livingArea,
-        "lotSize": lotSize,
-        "zestimate": zestimate,
-        "bedrooms": bedrooms,
-        "datePosted": datePosted,
-        "dateSold": dateSold,
-        "stories": stories,
-        "rentZestimate": rentZestimate,
-        "propertyTaxRate": propertyTaxRate,
-        "yearBuilt": yearBuilt,
-        "schoolsE": schoolsE,
-        "schoolsM": schoolsM,
-        "schoolsH": schoolsH,
-        "link": link,
-    }
+def deferredRow(zpid, prop, city, snapshot):
+    """
+    Row of a new or changed listing whose detail refresh was deferred: the
+    previous row, or the search result for a new listing, with the search
+    fields brought up to date.
+    """
+    if zpid not in snapshot:
+        return searchRecord(zpid, prop, city)
+    row = dict(snapshot[zpid])
+    for searchKey, column in CHANGE_FIELDS.items():
+        if searchKey in prop:
+            row[column] = prop[searchKey]
+    row["pricePerFt"] = pricePerFt(_number(row["price"]), _number(row["livingArea"]))
+    return row
 
 
-def getBasicData(cities, statusType, days):
-    querystring = {
-        "home_type": "Houses",
-        "bedsMin": 3,
-        "sort": "Price_High_Low",
-        "status_type": statusType,
-    }
-    if statusType == "RecentlySold":
-        querystring["soldInLast"] = days
-
-    allProps = []
-    url = f"{API_BASEURL}/propertyExtendedSearch"
-    cities_list = cities.split(",")
-    for city in cities_list:
-        queryWithPage = querystring.copy()
-        queryWithPage["location"] = f"{city}, {STATE}"
-        pageIdx = 1
-        totalPages = 1000
-        while pageIdx <= totalPages:
-            logger.debug(f"pageIdx: {pageIdx}")
-            queryWithPage["page"] = pageIdx
-            time.sleep(1)
-            response = requests.get(url, headers=HEADERS, params=queryWithPage)
-            responseJson = response.json()
-            if "props" not in responseJson:
-                raise Exception(
-                    f"Failed to GET {url}, please check your API token in .env. "
-                    + f"{responseJson}"
-                )
-            props = responseJson["props"]
-            keysToExtract = [
-                "price",
-                "zestimate",
-                "livingArea",
-                "lotAreaValue",
-                "zpid",
-                "rentZestimate",
-                "bedrooms",
-                "propertyType",
-                "address",
-            ]
-            # Creating a new dictionary with only the selected keys
-            keyProps = []
-            for prop in props:
-                keyProp = {key: prop[key] for key in keysToExtract}
-                zipcode = getZipCode(prop["address"])
-                keyProp["zipcode"] = zipcode
-                keyProp["city"] = city
-                dateSoldTimeStamp = prop["dateSold"] / 1000
-                dateSold = datetime.fromtimestamp(dateSoldTimeStamp).strftime(
-                    "%Y-%m-%d"
-                )
-                keyProp["dateSold"] = dateSold
-                if prop["price"] is None or prop["livingArea"] is None:
-                    pricePerFt = -1
-                else:
-                    pricePerFt = round(prop["price"] / prop["livingArea"], 2)
-                keyProp["pricePerFt"] = pricePerFt
-                keyProps.append(keyProp)
-            allProps.extend(keyProps)
-            totalPages = responseJson["totalPages"]
-            pageIdx += 1
-
-    formatted_date = datetime.now().strftime("%y%m%d")
-    outputFile = f"{statusType.lower()}_{formatted_date}_basic.csv"
-    write_to_csv(allProps, outputFile)
-    return outputFile
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
 
-def getForSaleData(cities):
+def getForSaleData(cities, concurrency, incremental=False, scheduler=None):
     querystring = {
         "home_type": "Houses",
         "bedsMin": 3,
         "sort": "Price_High_Low",
         "status_type": "ForSale",
     }
-    allProps = []
     formatted_date = datetime.now().strftime("%y%m%d")
-    url = f"{API_BASEURL}/propertyExtendedSearch"
-    cities_list = cities.split(",")
-    zpids = []
-    for city in cities_list:
-        queryWithPage = querystring.copy()
-        queryWithPage["location"] = f"{city}, {STATE}"
-        pageIdx = 1
-        totalPages = 1000
-        while pageIdx <= totalPages:
-            queryWithPage["page"] = pageIdx
-            response = requests.get(url, headers=HEADERS, params=queryWithPage)
-            responseJson = response.json()
-            if "props" not in responseJson:
-                raise Exception(
-                    f"Failed to GET {url}, please check your API token in .env. "
-                    + f"{responseJson}"
-                )
-            # print(responseJson)
-            props = responseJson["props"]
+    searchProps = {}
+    searchCities = {}
+    with profiler.span("search"):
+        for city, props in searchAllPages(querystring, cities, concurrency):
             for prop in props:
-                zpids.append(prop["zpid"])
-            totalPages = responseJson["totalPages"]
-            pageIdx += 1
+                zpid = str(prop["zpid"])
+                searchProps.setdefault(zpid, prop)
+                searchCities.setdefault(zpid, city)
     inventoryTodayFile = f"forsale_{formatted_date}.csv"
-    oldZpids = []
-    if os.path.isfile(inventoryTodayFile):
-        oldDf = pd.read_csv(inventoryTodayFile)
-        oldDf["zpid"] = oldDf["zpid"].astype(str)
-        oldZpids = oldDf["zpid"].tolist()
-        logger.info(oldZpids)
-    for zpid in zpids:
-        if zpid in oldZpids:
-            row = oldDf[oldDf["zpid"] == zpid]
-            logger.info(f"skip existing {zpid}")
-            propInfo = {
-                "zpid": zpid,
-                "address": row["address"].values[0],
-                "city": row["city"].values[0],
-                "zipcode": row["zipcode"].values[0],
-                "homeStatus": row["homeStatus"].values[0],
-                "price": row["price"].values[0],
-                "pricePerFt": row["pricePerFt"].values[0],
-                "listingPrice": row["listingPrice"].values[0],
-                "livingArea": row["livingArea"].values[0],
-                "lotSize": row["lotSize"].values[0],
-                "zestimate": row["zestimate"].values[0],
-                "bedrooms": row["bedrooms"].values[0],
-                "datePosted": row["datePosted"].values[0],
-                "dateSold": row["dateSold"].values[0],
-                "stories": row["stories"].values[0],
-                "rentZestimate": row["rentZestimate"].values[0],
-                "propertyTaxRate": row["propertyTaxRate"].values[0],
-                "yearBuilt": row["yearBuilt"].values[0],
-                "schoolsE": row["schoolsE"].values[0],
-                "schoolsM": row["schoolsM"].values[0],
-                "schoolsH": row["schoolsH"].values[0],
-                "link": row["link"].values[0],
-            }
-        else:
-            propInfo = getDetailByZpid(zpid)
-        allProps.append(propInfo)
-
-    # print(allProps)
-    write_to_csv(allProps, inventoryTodayFile)
+    # Without --incremental only today's rows are reused, as they are at most
+    # a few hours old. With it, the latest snapshot of any date is the
+    # baseline and only listings whose search fields changed are refetched.
+    baselineFile = findLatestSnapshot() if incremental else inventoryTodayFile
+    snapshot = {}
+    if baselineFile is not None and os.path.isfile(baselineFile):
+        snapshot = loadSnapshot(baselineFile)
+        logger.info(f"loaded {len(snapshot)} rows from {baselineFile}")
+    # Rows of listings an earlier budgeted run deferred only hold their
+    # search fields; they are refreshed like changed ones until fetched.
+    owedSet = set(scheduler.owed(list(searchProps))) if scheduler is not None else set()
+    changedZpids = [
+        zpid
+        for zpid, prop in searchProps.items()
+        if zpid not in snapshot
+        or zpid in owedSet
+        or (incremental and hasChanged(prop, snapshot[zpid]))
+    ]
+    logger.info(
+        f"{len(changedZpids)} of {len(searchProps)} listings need a detail refresh"
+    )
+    staleZpids = changedZpids
+    changedSet = set(changedZpids)
+    if scheduler is not None and scheduler.limited:
+        candidates = changedSet
+        if incremental:
+            # Carried forward rows age; with a budget they compete for the
+            # calls the new and changed listings leave over.
+            candidates = changedSet | set(
+                scheduler.dueUnchanged(
+                    [zpid for zpid in searchProps if zpid not in changedSet]
+                )
+            )
+        staleZpids = scheduler.plan(
+            (zpid, zpid in changedSet) for zpid in searchProps if zpid in candidates
+        )
+    # Fetched before writing so the stages time the crawl and the output
+    # apart; /property responses are parsed on the pool as they arrive.
+    with profiler.span("fetch", listings=len(staleZpids)):
+        details = iter(list(fetchStream(getDetailByZpid, staleZpids, concurrency)))
+    staleSet = set(staleZpids)
+
+    def iterRows():
+        for zpid in searchProps:
+            if zpid in staleSet:
+                record = next(details)
+                if scheduler is not None:
+                    scheduler.recordRecord(record)
+                yield record
+            elif zpid in changedSet:
+                # Deferred by the budget: the search result still gives the
+                # current price and status, the rest waits for a refresh.
+                logger.debug(f"changed listing {zpid} deferred to a later run")
+                yield deferredRow(zpid, searchProps[zpid], searchCities[zpid], snapshot)
+            else:
+                logger.debug(f"skip existing {zpid}")
+                yield snapshot[zpid]
+
+    with profiler.span("csv_write"):
+        # Today's file may be the baseline being carried forward: it is only
+        # replaced once the run completes.
+        rowCount = writeCsvStream(
+            iterRows(), inventoryTodayFile, DETAIL_FIELDS, atomic=True
+        )
+    logger.info(f"{inventoryTodayFile} is created with {rowCount} rows")
+    with metrics.stage("store"):
+        # Imported here, pandas and pyarrow are not needed by basic mode.
+        import snapshot_store
+
+        snapshot_store.writeSnapshotFromCsv(
+            "forsale", inventoryTodayFile, datetime.now().strftime("%Y-%m-%d")
+        )
     return inventoryTodayFile
 
 
-def getRecentSoldData(cities, recentDays):
+def getRecentSoldData(cities, recentDays, concurrency):
     querystring = {
         "home_type": "Houses",
         "bedsMin": 3,
@@ -328,43 +382,46 @@ def getRecentSoldData(cities, recentDays):
         "soldInLast": str(recentDays),
         "status_type": "RecentlySold",
     }
-    url = f"{API_BASEURL}/propertyExtendedSearch"
-    allProps = []
-    cities_list = cities.split(",")
-    for city in cities_list:
-        queryWithPage = querystring.copy()
-        queryWithPage["location"] = f"{city}, {STATE}"
-        pageIdx = 1
-        totalPages = 1000
-        while pageIdx <= totalPages:
-            queryWithPage["page"] = pageIdx
-            response = requests.get(url, headers=HEADERS, params=queryWithPage)
-            # print(response.status_code)
-            responseJson = response.json()
-            if "props" not in responseJson:
-                raise Exception(
-                    f"Failed to GET {url}, please check your API token in .env"
-                )
-            # print(responseJson)
-            props = responseJson["props"]
-            # print(props[0])
-            for prop in props:
-                zpid = prop["zpid"]
-                propInfo = getDetailByZpid(zpid)
-                allProps.append(propInfo)
-            totalPages = responseJson["totalPages"]
-            pageIdx += 1
+    with profiler.span("search"):
+        zpids = [
+            prop["zpid"]
+            for city, props in searchAllPages(querystring, cities, concurrency)
+            for prop in props
+        ]
+    with profiler.span("fetch", listings=len(zpids)):
+        details = list(fetchStream(getDetailByZpid, zpids, concurrency))
     formatted_date = datetime.now().strftime("%y%m%d")
     outputFile = f"sold_{formatted_date}.csv"
-    write_to_csv(allProps, outputFile)
+    with profiler.span("csv_write"):
+        rowCount = writeCsvStream(details, outputFile, DETAIL_FIELDS)
+    logger.info(f"{outputFile} is created with {rowCount} rows")
+    with metrics.stage("store"):
+        import snapshot_store
+
+        snapshot_store.writeSnapshotFromCsv(
+            "sold", outputFile, datetime.now().strftime("%Y-%m-%d")
+        )
     return outputFile
 
 
+@script_log.logsTo("get_zillow_data.log")
 def main(args):
     cities = args.cities
     statusType = args.status
     recentDays = args.days
     mode = args.mode
+    rate_limiter.configureFromArgs(args)
+    api_client.configure(args.concurrency)
+    response_cache.configureFromArgs(args)
+    response_archive.configureFromArgs(args)
+    metrics.configureFromArgs(args, f"get_zillow_data_{statusType}_{mode}")
+    profiler.configureFromArgs(args, f"get_zillow_data_{statusType}_{mode}")
+    uploader.configureFromArgs(args)
+    journal = crawl_journal.configure(
+        f"get_zillow_data_{statusType}_{mode}_{recentDays}_{cities}", args.resume
+    )
+    if args.resume:
+        logger.info(f"resuming with {journal.resumedCount()} journaled results")
     if statusType not in ["ForSale", "RecentlySold"]:
         logger.error(f"Incorrect status: {statusType}")
         sys.exit(-1)
@@ -377,23 +434,28 @@ def main(args):
             if args.upload:
                 logger.warning("Upload option is not available for this mode")
             else:
-                getBasicData(cities, statusType, recentDays)
+                getBasicData(cities, statusType, recentDays, args.concurrency)
         else:
-            outputFile = getForSaleData(cities)
+            outputFile = getForSaleData(
+                cities,
+                args.concurrency,
+                args.incremental,
+                refresh_scheduler.configureFromArgs(args),
+            )
             if args.upload:
-                uploadBlob(outputFile)
+                uploader.uploadFiles([(outputFile, DESTINATION_BLOB_NAME)])
     else:
         if args.upload:
             logger.warning("Upload option is not available for this mode")
             return
         if mode == "basic":
-            getBasicData(cities, statusType, recentDays)
+            getBasicData(cities, statusType, recentDays, args.concurrency)
         else:
-            getRecentSoldData(cities, recentDays)
+            getRecentSoldData(cities, recentDays, args.concurrency)
+    crawl_journal.finish()
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Get city house data from Zillow")
+def addArgs(parser):
     parser.add_argument("--cities", required=True, help="City Name")
     parser.add_argument("--status", default="ForSale", help="[ForSale|RecentlySold]")
     parser.add_argument("--mode", default="basic", help="[basic|advanced]")
@@ -402,5 +464,29 @@ if __name__ == "__main__":
     )
     uploadHelpMsg = "Enable Upload to GCP mode, only work for ForSale advanced mode"
     parser.add_argument("--upload", action="store_true", help=uploadHelpMsg)
+    uploader.addUploadArgs(parser)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="ForSale advanced mode only: reuse the latest snapshot and only "
+        + "fetch details of new or changed listings",
+    )
+    addConcurrencyArgs(parser)
+    refresh_scheduler.addSchedulerArgs(parser)
+    crawl_journal.addResumeArgs(parser)
+    response_cache.addCacheArgs(parser)
+    response_archive.addArchiveArgs(parser)
+    metrics.addMetricsArgs(parser)
+    profiler.addProfileArgs(parser)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Get city house data from Zillow")
+    addArgs(parser)
     args = parser.parse_args()
-    main(args)
+    try:
+        main(args)
+    except rate_limiter.QuotaExhausted as e:
+        # The crawl journal is kept, nothing fetched so far is lost.
+        logger.error(f"Stopped, API quota exhausted: {e}; rerun with --resume once it resets")
+        sys.exit(2)
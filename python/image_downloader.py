@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api_client
+import profiler
+
+# Remembers every downloaded photo: url -> {"path", "size", "sha256"}.
+INDEX_FILE = "pics/.image_index.json"
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.skipped = 0
+        self.deduped = 0
+        self.resumed = 0
+        self.bytes = 0
+        self.startedAt = time.perf_counter()
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self):
+        seconds = time.perf_counter() - self.startedAt
+        megabytes = self.bytes / (1024 * 1024)
+        return (
+            f"{self.downloaded} downloaded ({self.resumed} resumed), "
+            + f"{self.skipped} already on disk, {self.deduped} deduplicated, "
+            + f"{megabytes:.1f} MB in {seconds:.1f}s "
+            + f"({megabytes / max(seconds, 1e-9):.2f} MB/s)"
+        )
+
+
+def rangeStart(response):
+    """First byte offset of a 206 response's Content-Range, None if unreadable."""
+    match = re.fullmatch(
+        r"bytes (\d+)-\d+/(?:\d+|\*)", response.headers.get("Content-Range", "").strip()
+    )
+    return int(match.group(1)) if match else None
+
+
+class ImageDownloader:
+    """
+    Download listing photos on a worker pool. Files already on disk with the
+    expected size are skipped, partial ".part" files are resumed with an HTTP
+    Range request, and a url already downloaded for another zpid is hard
+    linked without a request. Photos whose content turns out, once
+    downloaded, to match another photo are hard linked too: that saves disk
+    space, not bandwidth.
+    """
+
+    def __init__(self, concurrency=8, indexFile=INDEX_FILE):
+        self.concurrency = concurrency
+        self.indexFile = indexFile
+        self.lock = threading.Lock()
+        self.stats = DownloadStats()
+        self.byUrl = {}
+        if os.path.isfile(indexFile):
+            with open(indexFile) as fp:
+                self.byUrl = json.load(fp)
+        self.bySha = {entry["sha256"]: entry["path"] for entry in self.byUrl.values()}
+
+    def saveIndex(self):
+        os.makedirs(os.path.dirname(self.indexFile) or ".", exist_ok=True)
+        tmpFile = f"{self.indexFile}.tmp"
+        with self.lock, open(tmpFile, "w") as fp:
+            json.dump(self.byUrl, fp)
+        os.replace(tmpFile, self.indexFile)
+
+    def _remember(self, url, path, size, sha256):
+        with self.lock:
+            self.byUrl[url] = {"path": path, "size": size, "sha256": sha256}
+            self.bySha.setdefault(sha256, path)
+
+    def _link(self, source, target):
+        if os.path.abspath(source) == os.path.abspath(target):
+            return
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            # Hard links are not available on every filesystem.
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                dst.write(src.read())
+
+    def _isComplete(self, url, savePath):
+        if not os.path.isfile(savePath):
+            return False
+        entry = self.byUrl.get(url)
+        if entry is not None:
+            return entry["size"] == os.path.getsize(savePath)
+        # Downloaded before the index existed: trust it if the size matches.
+        response = api_client.head(url)
+        expected = response.headers.get("Content-Length")
+        return expected is not None and int(expected) == os.path.getsize(savePath)
+
+    @profiler.traced("photo_fetch")
+    def fetch(self, url, savePath):
+        if self._isComplete(url, savePath):
+            self.stats.add(skipped=1)
+            return savePath
+        entry = self.byUrl.get(url)
+        if entry is not None and os.path.isfile(entry["path"]):
+            # Same photo url as an already downloaded listing (e.g. relisted).
+            self._link(entry["path"], savePath)
+            self._remember(url, savePath, entry["size"], entry["sha256"])
+            self.stats.add(deduped=1)
+            return savePath
+
+        partPath = f"{savePath}.part"
+        offset = os.path.getsize(partPath) if os.path.isfile(partPath) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = api_client.download(url, headers=headers)
+        if response.status_code == 416:
+            # The part file already holds the whole image.
+            response.close()
+            response = None
+        else:
+            response.raise_for_status()  # Raise an HTTPError for bad responses
+            if response.status_code == 206 and rangeStart(response) != offset:
+                # Not the range we asked for, the part file cannot be trusted.
+                response.close()
+                offset = 0
+                response = api_client.download(url)
+                response.raise_for_status()
+            elif response.status_code != 206:
+                offset = 0
+        received = 0
+        if response is not None:
+            with open(partPath, "ab" if offset else "wb") as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+                    received += len(chunk)
+
+        sha = hashlib.sha256()
+        with open(partPath, "rb") as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        sha256 = sha.hexdigest()
+        size = os.path.getsize(partPath)
+        os.replace(partPath, savePath)
+        self.stats.add(downloaded=1, resumed=1 if offset else 0, bytes=received)
+
+        existing = self.bySha.get(sha256)
+        if existing is not None and existing != savePath and os.path.isfile(existing):
+            self._link(existing, savePath)
+            self.stats.add(deduped=1)
+        self._remember(url, savePath, size, sha256)
+        return savePath
+
+    def fetchAll(self, jobs):
+        """Download (url, savePath) pairs and return the saved paths in order."""
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+                paths = list(executor.map(lambda job: self.fetch(*job), jobs))
+        finally:
+            # Keep the photos that did download, even if another one failed.
+            self.saveIndex()
+        return paths
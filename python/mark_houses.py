@@ -1,95 +1,40 @@
 import argparse
-import requests
-import csv
 import json
-from datetime import datetime
-import time
 import os
+import sys
 
-
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
-
-if os.environ.get("X_RAPIDAPI_KEY") is None:
-    raise Exception("Envionment variable X_RAPIDAPI_KEY is not set")
-
-STATE = "ca"
-if os.environ.get("STATE") is not None:
-    STATE = os.environ.get("STATE")
-
-API_BASEURL = "https://zillow-com1.p.rapidapi.com"
-
-HEADERS = {
-    "X-RapidAPI-Key": os.environ.get("X_RAPIDAPI_KEY"),
-    "X-RapidAPI-Host": "zillow-com1.p.rapidapi.com",
-}
-
-MARKED_CONFIG_FILE = "marked.csv"
+import api_client
+import marked_registry
+import metrics
+import profiler
+import rate_limiter
+import response_archive
+import response_cache
+from fetcher import addConcurrencyArgs
+from image_downloader import ImageDownloader
 
 
+@profiler.traced("image_urls")
 def getPicUrls(zpid):
-    time.sleep(1)
-    url = f"{API_BASEURL}/images"
     querystring = {"zpid": zpid}
-    print(f"querystring: {querystring}")
-    response = requests.get(url, headers=HEADERS, params=querystring)
-    responseJson = response.json()
+    responseJson = api_client.getJson("/images", querystring)
     urls = responseJson["images"]
     return urls
 
 
-def downloadFile(url, save_path):
-    """
-    Download a file from a given URL and save it to a specified path.
-
-    :param url: URL of the file to be downloaded
-    :param save_path: Path where the downloaded file will be saved
-    """
-    # Send a GET request to the URL
-    response = requests.get(url, stream=True)
-    response.raise_for_status()  # Raise an HTTPError for bad responses (4xx and 5xx)
-
-    # Write the content of the response to the specified save_path
-    with open(save_path, "wb") as file:
-        for chunk in response.iter_content(
-            chunk_size=8192
-        ):  # Download in chunks of 8KB
-            file.write(chunk)
-    print(f"File downloaded successfully to {save_path}.")
-
-
-def downloadPics(zpid, urls):
+@profiler.traced("photo_download")
+def downloadPics(zpid, urls, downloader):
     dirPath = f"pics/{zpid}"
     if not os.path.exists(dirPath):
         os.makedirs(dirPath)
-    for url in urls:
-        filename = os.path.basename(url)
-        filePath = f"{dirPath}/{filename}"
-        downloadFile(url, filePath)
-
-
-def getMarkedZpids():
-    with open(MARKED_CONFIG_FILE, "r") as csvfile:
-        reader = csv.DictReader(csvfile)
-        zpids = [int(row["zpid"]) for row in reader]
-    return zpids
-
-
-def appendNewZpidToMarkedConfig(zpid):
-    nowDate = datetime.now().strftime("%y%m%d")
-    with open(MARKED_CONFIG_FILE, "a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow([zpid, nowDate])
+    jobs = [(url, f"{dirPath}/{os.path.basename(url)}") for url in urls]
+    for filePath in downloader.fetchAll(jobs):
+        print(f"File downloaded successfully to {filePath}.")
 
 
+@profiler.traced("detail_fetch")
 def getDetailJson(zpid):
-    time.sleep(1)
-    url = f"{API_BASEURL}/property"
-    querystring = {"zpid": zpid}
-    response = requests.get(url, headers=HEADERS, params=querystring)
-    responseJson = response.json()
+    responseJson = marked_registry.fetchDetailJson(zpid)
     dirPath = f"pics/{zpid}"
     if not os.path.exists(dirPath):
         os.makedirs(dirPath)
@@ -99,20 +44,53 @@ def getDetailJson(zpid):
 
 
 def main(args):
+    rate_limiter.configureFromArgs(args)
+    api_client.configure(args.concurrency)
+    response_cache.configureFromArgs(args)
+    response_archive.configureFromArgs(args)
+    metrics.configureFromArgs(args, "mark_houses")
+    profiler.configureFromArgs(args, "mark_houses")
+    downloader = ImageDownloader(args.concurrency)
+    registry = marked_registry.configureFromArgs(args)
     zpids = args.zpids
     zpidList = zpids.split(",")
-    markedZpids = getMarkedZpids()
     for zpid in zpidList:
-        if zpid in markedZpids:
+        entry = registry.get(zpid)
+        if entry is None:
+            registry.upsert(zpid)
+            entry = registry.get(zpid)
+        if (
+            entry["imagesFetchedAt"] is not None
+            and entry["detailFetchedAt"] is not None
+        ):
+            print(f"skip already marked {zpid}")
             continue
-        urls = getPicUrls(zpid)
-        downloadPics(zpid, urls)
-        getDetailJson(zpid)
-        appendNewZpidToMarkedConfig(zpid)
+        if entry["imagesFetchedAt"] is None:
+            urls = getPicUrls(zpid)
+            downloadPics(zpid, urls, downloader)
+            registry.recordImages(zpid, len(urls))
+        if entry["detailFetchedAt"] is None:
+            getDetailJson(zpid)
+    print(f"Pictures: {downloader.stats.report()}")
+
+
+def addArgs(parser):
+    parser.add_argument("--zpids", required=True, help="zpids")
+    addConcurrencyArgs(parser)
+    response_cache.addCacheArgs(parser)
+    response_archive.addArchiveArgs(parser)
+    metrics.addMetricsArgs(parser)
+    profiler.addProfileArgs(parser)
+    marked_registry.addRegistryArgs(parser)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Mark house for future reference")
-    parser.add_argument("--zpids", required=True, help="zpids")
+    addArgs(parser)
     args = parser.parse_args()
-    main(args)
+    try:
+        main(args)
+    except rate_limiter.QuotaExhausted as e:
+        # Houses done so far are recorded in the registry and are skipped.
+        print(f"Stopped, API quota exhausted: {e}; rerun once it resets")
+        sys.exit(2)
@@ -0,0 +1,167 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import api_client
+from property_parser import loads
+
+REGISTRY_FILE = "marked.sqlite"
+# Imported once into an empty registry; mark_houses used to append to it.
+LEGACY_CONFIG_FILE = "marked.csv"
+# A stored /property response younger than this is reused instead of
+# calling the API again.
+DEFAULT_DETAIL_MAX_AGE = 12 * 60 * 60
+
+COLUMNS = [
+    "zpid",
+    "markedDate",
+    "detailFetchedAt",
+    "detailJson",
+    "imagesFetchedAt",
+    "imageCount",
+]
+
+
+class MarkedRegistry:
+    """SQLite table of marked houses and what has been fetched for them."""
+
+    def __init__(self, path=REGISTRY_FILE, legacyConfigFile=LEGACY_CONFIG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        # timeout: wait for other processes holding the write lock.
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS marked (
+                zpid TEXT PRIMARY KEY,
+                markedDate TEXT,
+                detailFetchedAt REAL,
+                detailJson TEXT,
+                imagesFetchedAt REAL,
+                imageCount INTEGER
+            )"""
+        )
+        self.conn.commit()
+        if len(self) == 0 and legacyConfigFile and os.path.isfile(legacyConfigFile):
+            self.importCsv(legacyConfigFile)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM marked").fetchone()[0]
+
+    def __contains__(self, zpid):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM marked WHERE zpid = ?", (str(zpid),)
+            ).fetchone()
+        return row is not None
+
+    def zpids(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT zpid FROM marked ORDER BY markedDate, rowid"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, zpid):
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM marked WHERE zpid = ?",
+                (str(zpid),),
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row is not None else None
+
+    def upsert(self, zpid, **fields):
+        """Insert the house or update only the given columns, in one statement."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown registry columns: {unknown}")
+        fields.setdefault("markedDate", datetime.now().strftime("%y%m%d"))
+        columns = ["zpid"] + list(fields)
+        updates = ", ".join(
+            f"{column} = excluded.{column}"
+            for column in fields
+            if column != "markedDate"
+        )
+        sql = (
+            f"INSERT INTO marked ({', '.join(columns)}) "
+            + f"VALUES ({', '.join('?' for _ in columns)}) "
+            + "ON CONFLICT(zpid) DO "
+            + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        )
+        with self.lock, self.conn:
+            self.conn.execute(sql, [str(zpid)] + list(fields.values()))
+
+    def importCsv(self, configPath):
+        with open(configPath, "r") as csvfile:
+            rows = list(csv.reader(csvfile))
+        # The legacy file has a header row and "zpid,yymmdd" rows.
+        zpids = []
+        for row in rows[1:]:
+            if row:
+                fields = {"markedDate": row[1]} if len(row) > 1 and row[1] else {}
+                self.upsert(row[0], **fields)
+                zpids.append(row[0])
+        return zpids
+
+    def recordDetail(self, zpid, detailJson):
+        self.upsert(
+            zpid, detailFetchedAt=time.time(), detailJson=json.dumps(detailJson)
+        )
+
+    def recordImages(self, zpid, imageCount):
+        self.upsert(zpid, imagesFetchedAt=time.time(), imageCount=imageCount)
+
+    def freshDetail(self, zpid, maxAge=DEFAULT_DETAIL_MAX_AGE):
+        entry = self.get(zpid)
+        if entry is None or entry["detailFetchedAt"] is None:
+            return None
+        if time.time() - entry["detailFetchedAt"] > maxAge:
+            return None
+        return loads(entry["detailJson"])
+
+    def fetchDetailJson(self, zpid, maxAge=DEFAULT_DETAIL_MAX_AGE):
+        """/property response of a marked house, from the registry when recent enough."""
+        detailJson = self.freshDetail(zpid, maxAge)
+        if detailJson is None:
+            detailJson = api_client.getJson("/property", {"zpid": zpid})
+            if "zpid" in detailJson and zpid in self:
+                self.recordDetail(zpid, detailJson)
+        return detailJson
+
+
+_registry = None
+_maxAge = DEFAULT_DETAIL_MAX_AGE
+
+
+def configure(path=REGISTRY_FILE, maxAge=DEFAULT_DETAIL_MAX_AGE):
+    global _registry, _maxAge
+    _registry = MarkedRegistry(path)
+    _maxAge = maxAge
+    return _registry
+
+
+def configureFromArgs(args):
+    return configure(args.registry, args.max_age_hours * 3600)
+
+
+def fetchDetailJson(zpid):
+    if _registry is None:
+        return api_client.getJson("/property", {"zpid": zpid})
+    return _registry.fetchDetailJson(zpid, _maxAge)
+
+
+def addRegistryArgs(parser):
+    parser.add_argument(
+        "--registry", default=REGISTRY_FILE, help="marked houses sqlite registry"
+    )
+    parser.add_argument(
+        "--max-age-hours",
+        type=float,
+        default=DEFAULT_DETAIL_MAX_AGE / 3600,
+        help="reuse stored property details younger than this",
+    )
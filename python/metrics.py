@@ -0,0 +1,311 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import profiler
+
+METRICS_DIR = "metrics"
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+# RapidAPI reports the plan quota on every response.
+QUOTA_LIMIT_HEADER = "X-RateLimit-Requests-Limit"
+QUOTA_REMAINING_HEADER = "X-RateLimit-Requests-Remaining"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.statuses = {}
+        self.errors = 0
+        self.cacheHits = 0
+        self.bytes = 0
+        self.latencies = []
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    @property
+    def requests(self):
+        return sum(self.statuses.values()) + self.errors
+
+    def observe(self, status, seconds, size):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+        self.latencies.append(seconds)
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[idx] += 1
+                break
+
+    def summary(self):
+        requests = self.requests
+        failed = self.errors + sum(
+            count for status, count in self.statuses.items() if status >= 400
+        )
+        return {
+            "requests": requests,
+            "cacheHits": self.cacheHits,
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "connectionErrors": self.errors,
+            "rateLimited": self.statuses.get(429, 0),
+            "errorRate": round(failed / requests, 4) if requests else 0.0,
+            "bytes": self.bytes,
+            "latencySeconds": {
+                "total": round(sum(self.latencies), 3),
+                "p50": round(percentile(self.latencies, 50), 4),
+                "p90": round(percentile(self.latencies, 90), 4),
+                "p99": round(percentile(self.latencies, 99), 4),
+                "max": round(max(self.latencies, default=0.0), 4),
+            },
+        }
+
+
+class Metrics:
+    """
+    In-process counters for one run: API requests per endpoint, the RapidAPI
+    quota seen in response headers, and time spent per pipeline stage
+    (summed across worker threads).
+    """
+
+    def __init__(self, runName="run"):
+        self.runName = runName
+        self.startedAt = time.time()
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.stages = {}
+        self.quotaLimit = None
+        self.quotaRemaining = None
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    def observeResponse(self, endpoint, response, size=None):
+        """Record a requests.Response; size defaults to the body length."""
+        if size is None:
+            size = int(response.headers.get("Content-Length") or len(response.content))
+        limit = response.headers.get(QUOTA_LIMIT_HEADER)
+        remaining = response.headers.get(QUOTA_REMAINING_HEADER)
+        with self.lock:
+            self._endpoint(endpoint).observe(
+                response.status_code, response.elapsed.total_seconds(), size
+            )
+            if limit is not None:
+                self.quotaLimit = int(limit)
+            if remaining is not None:
+                # Responses can arrive out of order; the lowest value is newest.
+                remaining = int(remaining)
+                if self.quotaRemaining is None or remaining < self.quotaRemaining:
+                    self.quotaRemaining = remaining
+
+    def observeError(self, endpoint):
+        with self.lock:
+            self._endpoint(endpoint).errors += 1
+
+    def observeCacheHit(self, endpoint):
+        with self.lock:
+            self._endpoint(endpoint).cacheHits += 1
+
+    def addStageTime(self, name, seconds):
+        with self.lock:
+            total, count = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (total + seconds, count + 1)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with profiler.span(name):
+                yield
+        finally:
+            self.addStageTime(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "run": self.runName,
+                "startedAt": datetime.fromtimestamp(self.startedAt).isoformat(),
+                "seconds": round(time.time() - self.startedAt, 3),
+                "quota": {"limit": self.quotaLimit, "remaining": self.quotaRemaining},
+                "endpoints": {
+                    endpoint: stats.summary()
+                    for endpoint, stats in sorted(self.endpoints.items())
+                },
+                "stages": {
+                    name: {"seconds": round(total, 4), "count": count}
+                    for name, (total, count) in sorted(self.stages.items())
+                },
+            }
+
+    def prometheusText(self):
+        """The metrics in the Prometheus text exposition format."""
+        run = f'run="{self.runName}"'
+        families = {}
+
+        def sample(name, kind, labels, value):
+            families.setdefault(name, (kind, []))[1].append(
+                f"{name}{{{labels}}} {value}"
+            )
+
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                labels = f'{run},endpoint="{endpoint}"'
+                for status, count in sorted(stats.statuses.items()):
+                    sample(
+                        "dreamhouse_api_requests_total",
+                        "counter",
+                        f'{labels},status="{status}"',
+                        count,
+                    )
+                sample(
+                    "dreamhouse_api_connection_errors_total",
+                    "counter",
+                    labels,
+                    stats.errors,
+                )
+                sample(
+                    "dreamhouse_api_cache_hits_total", "counter", labels, stats.cacheHits
+                )
+                sample("dreamhouse_api_bytes_total", "counter", labels, stats.bytes)
+                histogram = "dreamhouse_api_latency_seconds"
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    sample(
+                        f"{histogram}_bucket",
+                        "histogram",
+                        f'{labels},le="{bound}"',
+                        cumulative,
+                    )
+                sample(
+                    f"{histogram}_bucket",
+                    "histogram",
+                    f'{labels},le="+Inf"',
+                    len(stats.latencies),
+                )
+                sample(f"{histogram}_sum", "histogram", labels, sum(stats.latencies))
+                sample(f"{histogram}_count", "histogram", labels, len(stats.latencies))
+            for name, (total, count) in sorted(self.stages.items()):
+                sample(
+                    "dreamhouse_stage_seconds_total",
+                    "counter",
+                    f'{run},stage="{name}"',
+                    total,
+                )
+            if self.quotaRemaining is not None:
+                sample("dreamhouse_quota_remaining", "gauge", run, self.quotaRemaining)
+            if self.quotaLimit is not None:
+                sample("dreamhouse_quota_limit", "gauge", run, self.quotaLimit)
+        sample(
+            "dreamhouse_run_last_finished_timestamp_seconds", "gauge", run, time.time()
+        )
+
+        lines = []
+        typed = set()
+        for name, (kind, samples) in families.items():
+            # _bucket/_sum/_count samples belong to one histogram family.
+            family = re.sub(r"_(bucket|sum|count)$", "", name) if kind == "histogram" else name
+            if family not in typed:
+                lines.append(f"# TYPE {family} {kind}")
+                typed.add(family)
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def _writeAtomic(path, text):
+    # The node_exporter textfile collector must never see a half written file.
+    tmpFile = f"{path}.tmp"
+    with open(tmpFile, "w") as fp:
+        fp.write(text)
+    os.replace(tmpFile, path)
+
+
+def export(registry, metricsDir=METRICS_DIR):
+    """
+    Write <run>.prom (overwritten by each run, for the node_exporter textfile
+    collector) and <run>_<timestamp>.json, and return the json path.
+    """
+    os.makedirs(metricsDir, exist_ok=True)
+    name = re.sub(r"[^\w.-]+", "_", registry.runName)
+    _writeAtomic(os.path.join(metricsDir, f"{name}.prom"), registry.prometheusText())
+    stamp = datetime.fromtimestamp(registry.startedAt).strftime("%y%m%d_%H%M%S")
+    summaryFile = os.path.join(metricsDir, f"{name}_{stamp}.json")
+    _writeAtomic(summaryFile, json.dumps(registry.summary(), indent=2))
+    return summaryFile
+
+
+# Shared by every API call site; a run that never calls configure() still
+# counts, it just exports nothing.
+_metrics = Metrics()
+_pendingExport = None
+
+
+def configure(runName, metricsDir=METRICS_DIR, enabled=True):
+    """Start counting a new run and export it when the process exits."""
+    global _metrics, _pendingExport
+    # An earlier run of this process (a chained command or a daemon job) is
+    # exported now, its atexit export is not left registered alongside.
+    finish()
+    _metrics = Metrics(runName)
+    _pendingExport = None
+    if enabled:
+        _pendingExport = functools.partial(export, _metrics, metricsDir)
+        atexit.register(_pendingExport)
+    return _metrics
+
+
+def finish():
+    """Export the current run now rather than at exit, for long-lived processes."""
+    global _pendingExport
+    if _pendingExport is not None:
+        atexit.unregister(_pendingExport)
+        _pendingExport()
+        _pendingExport = None
+
+
+def observeResponse(endpoint, response, size=None):
+    _metrics.observeResponse(endpoint, response, size)
+
+
+def observeError(endpoint):
+    _metrics.observeError(endpoint)
+
+
+def observeCacheHit(endpoint):
+    _metrics.observeCacheHit(endpoint)
+
+
+def addStageTime(name, seconds):
+    _metrics.addStageTime(name, seconds)
+
+
+def stage(name):
+    """Context manager adding the time spent inside it to a named stage."""
+    return _metrics.stage(name)
+
+
+def addMetricsArgs(parser):
+    parser.add_argument(
+        "--metrics-dir",
+        default=METRICS_DIR,
+        help="where the prometheus textfile and json run summary are written",
+    )
+    parser.add_argument(
+        "--no-metrics", action="store_true", help="do not write metrics files"
+    )
+
+
+def configureFromArgs(args, runName):
+    return configure(runName, args.metrics_dir, enabled=not args.no_metrics)
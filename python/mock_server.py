@@ -0,0 +1,343 @@
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import rate_limiter
+
+# Search snapshot the synthetic fixtures are generated from.
+DEFAULT_SEED_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "datasets", "forsale_231001.csv"
+)
+# Zillow returns 41 listings per search page.
+DEFAULT_PAGE_SIZE = 41
+DEFAULT_IMAGES_PER_HOUSE = 5
+DEFAULT_IMAGE_BYTES = 64 * 1024
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latencyMs=0.0,
+        jitterMs=0.0,
+        pageSize=DEFAULT_PAGE_SIZE,
+        rateLimit=None,
+        quota=None,
+        errorRate=0.0,
+        imagesPerHouse=DEFAULT_IMAGES_PER_HOUSE,
+        imageBytes=DEFAULT_IMAGE_BYTES,
+    ):
+        self.latencyMs = latencyMs
+        self.jitterMs = jitterMs
+        self.pageSize = pageSize
+        self.rateLimit = rateLimit
+        self.quota = quota
+        self.errorRate = errorRate
+        self.imagesPerHouse = imagesPerHouse
+        self.imageBytes = imageBytes
+
+
+def _toNumber(value):
+    if value in (None, ""):
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def loadSeedProps(seedCsv=DEFAULT_SEED_CSV):
+    """Turn a recorded forsale search csv into /propertyExtendedSearch props."""
+    props = []
+    with open(seedCsv, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            props.append(
+                {
+                    "zpid": row["zpid"],
+                    "address": row["address"],
+                    "price": _toNumber(row.get("price")),
+                    "zestimate": _toNumber(row.get("zestimate")),
+                    "livingArea": _toNumber(row.get("livingArea")),
+                    "lotAreaValue": _toNumber(row.get("lotAreaValue")),
+                    "rentZestimate": _toNumber(row.get("rentZestimate")),
+                    "bedrooms": _toNumber(row.get("bedrooms")),
+                    "propertyType": row.get("propertyType") or "SINGLE_FAMILY",
+                    "listingStatus": "FOR_SALE",
+                    "dateSold": 1696118400000,
+                    "city": row.get("city", ""),
+                }
+            )
+    return props
+
+
+def makeProperty(prop):
+    """Build a /property response consistent with a search prop."""
+    street = prop["address"].split(", ")[0]
+    zipcode = prop["address"][-5:]
+    return {
+        "zpid": prop["zpid"],
+        "address": {
+            "streetAddress": street,
+            "city": prop["city"],
+            "zipcode": zipcode,
+            "state": "CA",
+        },
+        "bedrooms": prop["bedrooms"],
+        "datePosted": "2023-09-01",
+        "dateSold": None,
+        "livingArea": prop["livingArea"],
+        "resoFacts": {"lotSize": f"{prop['lotAreaValue'] or 0} Acres", "stories": 2},
+        "rentZestimate": prop["rentZestimate"],
+        "propertyTaxRate": 1.24,
+        "yearBuilt": 1985,
+        "zestimate": prop["zestimate"],
+        "homeStatus": prop["listingStatus"],
+        "price": prop["price"],
+        "priceHistory": [
+            {"date": "2023-09-01", "event": "Listed for sale", "price": prop["price"]}
+        ],
+        "url": f"/homedetails/{prop['zpid']}_zpid/",
+        "schools": [
+            {"level": "Elementary", "rating": 8, "name": "Mock Elementary"},
+            {"level": "Middle", "rating": 7, "name": "Mock Middle"},
+            {"level": "High", "rating": 9, "name": "Mock High"},
+        ],
+    }
+
+
+class Fixtures:
+    """
+    Responses served by the mock server. A fixtures directory may hold
+    search.json (a list of props), property/<zpid>.json and
+    images/<zpid>.json recorded from the real API; anything missing is
+    synthesized from the seed csv.
+    """
+
+    def __init__(self, fixturesDir=None, seedCsv=DEFAULT_SEED_CSV):
+        self.fixturesDir = fixturesDir
+        searchFile = fixturesDir and os.path.join(fixturesDir, "search.json")
+        if searchFile and os.path.isfile(searchFile):
+            with open(searchFile) as fp:
+                self.props = json.load(fp)
+        else:
+            self.props = loadSeedProps(seedCsv)
+        self.propsByZpid = {str(prop["zpid"]): prop for prop in self.props}
+
+    def _recorded(self, kind, zpid):
+        if self.fixturesDir is None:
+            return None
+        path = os.path.join(self.fixturesDir, kind, f"{zpid}.json")
+        if not os.path.isfile(path):
+            return None
+        with open(path) as fp:
+            return json.load(fp)
+
+    def search(self, location, page, pageSize):
+        city = location.split(",")[0].strip().lower()
+        props = [p for p in self.props if p.get("city", "").lower() == city]
+        totalPages = max(1, math.ceil(len(props) / pageSize))
+        start = (page - 1) * pageSize
+        return {
+            "props": props[start : start + pageSize],
+            "resultsPerPage": pageSize,
+            "totalPages": totalPages,
+            "totalResultCount": len(props),
+        }
+
+    def property(self, zpid):
+        recorded = self._recorded("property", zpid)
+        if recorded is not None:
+            return recorded
+        prop = self.propsByZpid.get(str(zpid))
+        return makeProperty(prop) if prop is not None else None
+
+    def images(self, zpid, baseUrl, imagesPerHouse):
+        recorded = self._recorded("images", zpid)
+        if recorded is not None:
+            return recorded
+        if str(zpid) not in self.propsByZpid:
+            return None
+        return {
+            "images": [
+                f"{baseUrl}/photos/{zpid}/{idx}.jpg" for idx in range(imagesPerHouse)
+            ]
+        }
+
+
+class MockZillowServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, config):
+        super().__init__(address, MockZillowHandler)
+        self.fixtures = fixtures
+        self.config = config
+        self.limiter = (
+            rate_limiter.TokenBucket(config.rateLimit) if config.rateLimit else None
+        )
+        self.lock = threading.Lock()
+        self.requestCount = 0
+
+    @property
+    def baseUrl(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class MockZillowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, status, body, extraHeaders=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (extraHeaders or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def sendPhoto(self, zpid, idx):
+        config = self.server.config
+        # Deterministic bytes, so re-downloads and dedupe can be verified.
+        seed = f"{zpid}/{idx}".encode()
+        body = (seed * (config.imageBytes // len(seed) + 1))[: config.imageBytes]
+        start, end = 0, len(body) - 1
+        rangeHeader = self.headers.get("Range")
+        if rangeHeader and rangeHeader.startswith("bytes="):
+            first, _, last = rangeHeader[len("bytes=") :].partition("-")
+            start = int(first or 0)
+            end = int(last) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body[start : end + 1])
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        delay = config.latencyMs + random.uniform(-config.jitterMs, config.jitterMs)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if url.path.startswith("/photos/"):
+            _, _, zpid, filename = url.path.split("/")
+            self.sendPhoto(zpid, filename.split(".")[0])
+            return
+
+        with server.lock:
+            server.requestCount += 1
+            used = server.requestCount
+        headers = {}
+        if config.quota is not None:
+            headers = {
+                "X-RateLimit-Requests-Limit": str(config.quota),
+                "X-RateLimit-Requests-Remaining": str(max(0, config.quota - used)),
+                "X-RateLimit-Requests-Reset": "86400",
+            }
+            if used > config.quota:
+                self.sendJson(429, {"message": "You have exceeded the quota"}, headers)
+                return
+        if server.limiter is not None and not server.limiter.tryAcquire():
+            self.sendJson(429, {"message": "Too many requests"}, headers)
+            return
+        if random.random() < config.errorRate:
+            self.sendJson(500, {"message": "Injected error"}, headers)
+            return
+
+        if url.path == "/propertyExtendedSearch":
+            body = server.fixtures.search(
+                query.get("location", ""), int(query.get("page", 1)), config.pageSize
+            )
+        elif url.path == "/property":
+            body = server.fixtures.property(query.get("zpid"))
+        elif url.path == "/images":
+            body = server.fixtures.images(
+                query.get("zpid"), server.baseUrl, config.imagesPerHouse
+            )
+        else:
+            body = None
+        if body is None:
+            self.sendJson(404, {"message": f"Not found: {self.path}"}, headers)
+            return
+        self.sendJson(200, body, headers)
+
+
+def startServer(fixtures, config, host="127.0.0.1", port=0):
+    """Serve in a daemon thread and return the server; port 0 picks a free port."""
+    server = MockZillowServer((host, port), fixtures, config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def addMockArgs(parser):
+    parser.add_argument("--fixtures", help="directory of recorded responses")
+    parser.add_argument("--seed-csv", default=DEFAULT_SEED_CSV, help="search csv")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument(
+        "--rate-limit", type=float, help="requests per second before answering 429"
+    )
+    parser.add_argument("--quota", type=int, help="total API requests allowed")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of 500 responses"
+    )
+    parser.add_argument("--images", type=int, default=DEFAULT_IMAGES_PER_HOUSE)
+    parser.add_argument("--image-bytes", type=int, default=DEFAULT_IMAGE_BYTES)
+
+
+def configFromArgs(args):
+    return MockConfig(
+        latencyMs=args.latency_ms,
+        jitterMs=args.jitter_ms,
+        pageSize=args.page_size,
+        rateLimit=args.rate_limit,
+        quota=args.quota,
+        errorRate=args.error_rate,
+        imagesPerHouse=args.images,
+        imageBytes=args.image_bytes,
+    )
+
+
+def main(args):
+    fixtures = Fixtures(args.fixtures, args.seed_csv)
+    server = MockZillowServer(
+        (args.host, args.port), fixtures, configFromArgs(args)
+    )
+    print(f"Serving {len(fixtures.props)} listings on {server.baseUrl}")
+    print(f"export ZILLOW_API_BASEURL={server.baseUrl}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the RapidAPI Zillow endpoints"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    addMockArgs(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,204 @@
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+PROFILE_DIR = "profile"
+
+# Returned by span() when profiling is off, so disabled spans cost one check.
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """
+    Collect timed spans as Chrome trace events ("X" complete events), which
+    chrome://tracing, Perfetto and speedscope all open. Spans opened on the
+    main thread outside any other span are stages: with cprofile they get
+    their own .prof file (covering the main thread only), and with
+    traceMemory their peak traced memory.
+    """
+
+    def __init__(self, runName, profileDir=PROFILE_DIR, cprofile=False, traceMemory=False):
+        self.runName = re.sub(r"[^\w.-]+", "_", runName)
+        self.profileDir = profileDir
+        self.cprofile = cprofile
+        self.traceMemory = traceMemory
+        self.stamp = datetime.now().strftime("%y%m%d_%H%M%S")
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threadNames = {}
+        self.stages = []
+        self.local = threading.local()
+        if traceMemory:
+            tracemalloc.start()
+
+    def _micros(self, seconds):
+        return round((seconds - self.origin) * 1e6, 1)
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        depth = getattr(self.local, "depth", 0)
+        isStage = depth == 0 and threading.current_thread() is threading.main_thread()
+        profile = None
+        if isStage and self.traceMemory:
+            tracemalloc.reset_peak()
+        if isStage and self.cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.local.depth = depth
+            if profile is not None:
+                profile.disable()
+            if isStage:
+                stage = {"name": name, "seconds": end - start}
+                if self.traceMemory:
+                    stage["peakBytes"] = tracemalloc.get_traced_memory()[1]
+                    args = {**args, "peakMB": round(stage["peakBytes"] / 2**20, 2)}
+                if profile is not None:
+                    stage["profile"] = self._dumpProfile(profile, name)
+                self.stages.append(stage)
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": self._micros(start),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+            }
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            with self.lock:
+                self.events.append(event)
+                self.threadNames[event["tid"]] = threading.current_thread().name
+
+    def _dumpProfile(self, profile, name):
+        os.makedirs(self.profileDir, exist_ok=True)
+        index = sum(1 for stage in self.stages if stage["name"] == name)
+        suffix = f"_{index}" if index else ""
+        path = os.path.join(
+            self.profileDir, f"{self.runName}_{self.stamp}_{name}{suffix}.prof"
+        )
+        profile.dump_stats(path)
+        return path
+
+    def traceEvents(self):
+        with self.lock:
+            threadNames = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self.threadNames.items()
+            ]
+            return threadNames + list(self.events)
+
+    def finish(self):
+        """Write the trace file and print the per-stage table."""
+        os.makedirs(self.profileDir, exist_ok=True)
+        traceFile = os.path.join(
+            self.profileDir, f"{self.runName}_{self.stamp}.trace.json"
+        )
+        with open(traceFile, "w") as fp:
+            json.dump(
+                {"traceEvents": self.traceEvents(), "displayTimeUnit": "ms"}, fp
+            )
+        print(f"{'stage':<24}{'seconds':>10}{'peak MB':>10}")
+        for stage in self.stages:
+            peak = stage.get("peakBytes")
+            peakText = f"{peak / 2**20:.1f}" if peak is not None else "-"
+            print(f"{stage['name']:<24}{stage['seconds']:>10.3f}{peakText:>10}")
+            if "profile" in stage:
+                print(f"  {stage['profile']}")
+        print(f"{traceFile} is created.")
+        if self.traceMemory:
+            tracemalloc.stop()
+        return traceFile
+
+
+_tracer = None
+
+
+def configure(runName, profileDir=PROFILE_DIR, cprofile=False, traceMemory=False):
+    """Start tracing; the trace is written when the process exits."""
+    global _tracer
+    finish()
+    _tracer = Tracer(runName, profileDir, cprofile, traceMemory)
+    atexit.register(_tracer.finish)
+    return _tracer
+
+
+def finish():
+    """Write the current trace now rather than at exit, and stop tracing."""
+    global _tracer
+    if _tracer is not None:
+        atexit.unregister(_tracer.finish)
+        _tracer.finish()
+        _tracer = None
+
+
+def span(name, **args):
+    """Context manager timing a named span; free when profiling is off."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, **args)
+
+
+def traced(name):
+    """Decorator running every call of the function inside span(name)."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def addProfileArgs(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="trace the run's stages into a chrome trace file",
+    )
+    parser.add_argument(
+        "--profile-dir", default=PROFILE_DIR, help="where profiling output is written"
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="with --profile, also write a cProfile .prof file per stage",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="with --profile, also record the peak memory of each stage",
+    )
+
+
+def configureFromArgs(args, runName):
+    if args.profile:
+        configure(runName, args.profile_dir, args.cprofile, args.tracemalloc)
+    else:
+        # A long-lived process (the scheduler daemon) may have traced an
+        # earlier run: write that trace instead of adding this run to it.
+        finish()
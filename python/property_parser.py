@@ -0,0 +1,221 @@
+import json
+import re
+from typing import NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:  # the standard library decoder is only slower
+    orjson = None
+
+ZILLOW_BASEURL = "https://zillow.com"
+
+
+def loads(body):
+    """Decode a JSON response body (bytes or str), with orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class PropertyRecord(NamedTuple):
+    """
+    One parsed /property response. The fields are the detail csv columns,
+    in order, shared by get_zillow_data, get_detail_data and get_marked_data.
+    """
+
+    zpid: str
+    address: Optional[str]
+    city: Optional[str]
+    zipcode: Optional[str]
+    homeStatus: Optional[str]
+    price: Optional[float]
+    latest_event: str
+    pricePerFt: float
+    listingPrice: float
+    livingArea: Optional[float]
+    lotSize: Optional[str]
+    zestimate: Optional[float]
+    bedrooms: Optional[int]
+    datePosted: Optional[str]
+    dateSold: Optional[str]
+    stories: Optional[int]
+    rentZestimate: Optional[float]
+    propertyTaxRate: Optional[float]
+    yearBuilt: Optional[int]
+    schoolsE: str
+    schoolsM: str
+    schoolsH: str
+    link: str
+
+
+DETAIL_FIELDS = list(PropertyRecord._fields)
+
+# pricePerFt / listingPrice when they cannot be computed.
+MISSING = -1
+
+SCHOOL_LEVELS = {"Elementary": "schoolsE", "Middle": "schoolsM", "High": "schoolsH"}
+
+
+def pricePerFt(price, livingArea):
+    if not price or not livingArea:
+        return MISSING
+    return round(price / livingArea, 2)
+
+
+def parseProperty(zpid, responseJson, baseUrl=ZILLOW_BASEURL):
+    """
+    Extract a PropertyRecord from a decoded /property response. Missing
+    fields become None (or "" for the text columns built here); a response
+    without an address, such as an API error message, raises ValueError.
+    """
+    addressInfo = responseJson.get("address")
+    if not isinstance(addressInfo, dict):
+        message = responseJson.get("message", "no address in response")
+        raise ValueError(f"No property details for {zpid}: {message}")
+    get = responseJson.get
+    resoFacts = get("resoFacts") or {}
+    historyEntries = get("priceHistory") or []
+    price = get("price")
+    livingArea = get("livingArea")
+
+    latestEvent = ""
+    if historyEntries:
+        latestEntry = historyEntries[0]
+        latestEvent = (
+            f"""{latestEntry.get("date")} {latestEntry.get("event")} """
+            + f"""{latestEntry.get("price")}"""
+        )
+    listingPrice = MISSING
+    for entry in historyEntries:
+        if entry.get("event") == "Listed for sale":
+            listingPrice = entry.get("price", MISSING)
+            break
+
+    schools = {"schoolsE": "", "schoolsM": "", "schoolsH": ""}
+    for school in get("schools") or []:
+        column = SCHOOL_LEVELS.get(school.get("level"))
+        if column is not None:
+            schools[column] = f"""{school.get("rating")},{school.get("name")}"""
+
+    pathLink = get("url")
+    return PropertyRecord(
+        zpid=str(zpid),
+        address=addressInfo.get("streetAddress"),
+        city=addressInfo.get("city"),
+        zipcode=addressInfo.get("zipcode"),
+        homeStatus=get("homeStatus"),
+        price=price,
+        latest_event=latestEvent,
+        pricePerFt=pricePerFt(price, livingArea),
+        listingPrice=listingPrice,
+        livingArea=livingArea,
+        lotSize=resoFacts.get("lotSize"),
+        zestimate=get("zestimate"),
+        bedrooms=get("bedrooms"),
+        datePosted=get("datePosted"),
+        dateSold=get("dateSold"),
+        stories=resoFacts.get("stories"),
+        rentZestimate=get("rentZestimate"),
+        propertyTaxRate=get("propertyTaxRate"),
+        yearBuilt=get("yearBuilt"),
+        link=f"{baseUrl}/{pathLink}" if pathLink else "",
+        **schools,
+    )
+
+
+def searchRecord(zpid, prop=None, city=None, baseUrl=ZILLOW_BASEURL):
+    """
+    A PropertyRecord from what a search result shows of a listing, for one
+    whose /property call was deferred. Columns only /property has are empty.
+    """
+    prop = prop or {}
+    address = prop.get("address") or ""
+    zipcode = re.search(r"\b\d{5}$", address)
+    price = prop.get("price")
+    livingArea = prop.get("livingArea")
+    return PropertyRecord(
+        zpid=str(zpid),
+        address=address.split(",")[0] or None,
+        city=city,
+        zipcode=zipcode.group(0) if zipcode else None,
+        homeStatus=prop.get("listingStatus"),
+        price=price,
+        latest_event="",
+        pricePerFt=pricePerFt(price, livingArea),
+        listingPrice=MISSING,
+        livingArea=livingArea,
+        lotSize=None,
+        zestimate=prop.get("zestimate"),
+        bedrooms=prop.get("bedrooms"),
+        datePosted=None,
+        # Search results give it in epoch ms, /property as a date.
+        dateSold=None,
+        stories=None,
+        rentZestimate=prop.get("rentZestimate"),
+        propertyTaxRate=None,
+        yearBuilt=None,
+        schoolsE="",
+        schoolsM="",
+        schoolsH="",
+        link=f"{baseUrl}/homedetails/{zpid}_zpid/",
+    )
+
+
+def toColumns(records):
+    """Transpose records (or journaled lists in field order) into {column: values}."""
+    columns = list(zip(*records)) or [()] * len(DETAIL_FIELDS)
+    return dict(zip(DETAIL_FIELDS, (list(values) for values in columns)))
+
+
+def _pyarrow():
+    # Imported on first use, it adds ~0.2s to the start of every script.
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception("pyarrow is required to build an Arrow table")
+    return pyarrow
+
+
+def arrowSchema():
+    """Arrow types of the PropertyRecord fields, from their annotations."""
+    pa = _pyarrow()
+    types = {str: pa.string(), float: pa.float64(), int: pa.int64()}
+    fields = []
+    for field, hint in PropertyRecord.__annotations__.items():
+        # Optional[float] -> float
+        baseType = getattr(hint, "__args__", (hint,))[0]
+        fields.append((field, types[baseType]))
+    return pa.schema(fields)
+
+
+def _toNumber(value, integer):
+    """value as a float (or an int if integer), None if it is not one."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not integer:
+        return number
+    return int(number) if number.is_integer() else None
+
+
+def toArrowTable(records):
+    """Build a pyarrow Table from a batch of records, one column at a time."""
+    pa = _pyarrow()
+    schema = arrowSchema()
+    columns = toColumns(records)
+    arrays = []
+    for field in schema:
+        values = columns[field.name]
+        if field.type == pa.string():
+            # e.g. dateSold is "YYYY-MM-DD" or epoch ms depending on the listing.
+            values = [value if value is None else str(value) for value in values]
+        else:
+            # The API sends e.g. 2.0 or "3" at times; what is not a number
+            # (or not a whole one, for int columns) becomes null.
+            integer = field.type == pa.int64()
+            values = [_toNumber(value, integer) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,273 @@
+import random
+import threading
+import time
+
+# Matches the old fixed time.sleep(1) between API calls.
+DEFAULT_RPS = 1.0
+# The adaptive limiter never slows down below this.
+MIN_RPS = 0.2
+# Consecutive successful responses before the rate is raised again, by
+# this fraction of the current rate (or MIN_RPS, whichever is larger).
+INCREASE_EVERY = 10
+INCREASE_FACTOR = 0.1
+# 429s of requests sent before the last slowdown took effect do not
+# lower the rate again within this many seconds.
+DECREASE_COOLDOWN = 1.0
+# Stop (or wait for the reset) when this many monthly requests are left.
+DEFAULT_QUOTA_RESERVE = 0
+# Wait for a quota reset at most this long instead of stopping the run.
+DEFAULT_MAX_QUOTA_WAIT = 15 * 60
+# Backoff of retried 429/5xx responses: full jitter, capped.
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# RapidAPI response headers, Reset is in seconds from now.
+QUOTA_LIMIT_HEADER = "X-RateLimit-Requests-Limit"
+QUOTA_REMAINING_HEADER = "X-RateLimit-Requests-Remaining"
+QUOTA_RESET_HEADER = "X-RateLimit-Requests-Reset"
+
+
+class QuotaExhausted(Exception):
+    """The plan's request quota is used up and does not reset soon."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket, refilled at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updatedAt) * self.rate
+        )
+        self.updatedAt = now
+
+    def setRate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = max(1.0, self.rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def tryAcquire(self, tokens=1):
+        """Take `tokens` tokens if they are available right now, without waiting."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` tokens are available and take them."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                waitSeconds = (tokens - self.tokens) / self.rate
+            time.sleep(waitSeconds)
+
+
+def _headerFloat(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def backoffDelay(attempt, retryAfter=None):
+    """Seconds to wait before retry number `attempt` (0 based)."""
+    if retryAfter is not None:
+        return retryAfter + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class AdaptiveLimiter:
+    """
+    Token bucket whose rate follows the API's answers: halved on a 429
+    (at most once per DECREASE_COOLDOWN, down to MIN_RPS), raised again by 10% after INCREASE_EVERY
+    consecutive successes (up to maxRps). A 429 with Retry-After pauses all
+    workers for that long. When the RapidAPI quota headers show that no
+    more than quotaReserve requests are left, acquire() waits for the reset
+    if it is within maxQuotaWait seconds, else raises QuotaExhausted.
+    """
+
+    def __init__(
+        self,
+        maxRps,
+        quotaReserve=DEFAULT_QUOTA_RESERVE,
+        maxQuotaWait=DEFAULT_MAX_QUOTA_WAIT,
+    ):
+        self.maxRps = float(maxRps)
+        self.bucket = TokenBucket(maxRps)
+        self.quotaReserve = quotaReserve
+        self.maxQuotaWait = maxQuotaWait
+        self.lock = threading.Lock()
+        self.successes = 0
+        self.decreasedAt = 0.0
+        self.pausedUntil = 0.0
+        self.quotaRemaining = None
+        self.quotaResetAt = None
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _quotaWait(self):
+        """Seconds to wait for the quota; raises if it will not reset in time."""
+        if self.quotaRemaining is None or self.quotaRemaining > self.quotaReserve:
+            return 0.0
+        wait = None if self.quotaResetAt is None else self.quotaResetAt - time.monotonic()
+        if wait is None or wait > self.maxQuotaWait:
+            raise QuotaExhausted(
+                f"{self.quotaRemaining:.0f} API requests left in this plan period"
+                + ("" if wait is None else f", resets in {wait / 3600:.1f}h")
+            )
+        return max(0.0, wait)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = max(self.pausedUntil - time.monotonic(), self._quotaWait())
+                if wait <= 0 and self.quotaRemaining is not None:
+                    # Count the request now, so concurrent workers do not
+                    # all spend the last few requests of the quota.
+                    self.quotaRemaining -= 1
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+    def onResponse(self, status, headers):
+        """Adapt to a response; returns its Retry-After in seconds, if any."""
+        remaining = _headerFloat(headers, QUOTA_REMAINING_HEADER)
+        reset = _headerFloat(headers, QUOTA_RESET_HEADER)
+        retryAfter = _headerFloat(headers, "Retry-After")
+        with self.lock:
+            if remaining is not None:
+                # Responses can arrive out of order, so the lowest value is
+                # the newest one, until the quota period has been reset.
+                resetPassed = (
+                    self.quotaResetAt is not None
+                    and time.monotonic() >= self.quotaResetAt
+                )
+                if (
+                    self.quotaRemaining is None
+                    or remaining < self.quotaRemaining
+                    or resetPassed
+                ):
+                    self.quotaRemaining = remaining
+                if reset is not None:
+                    self.quotaResetAt = time.monotonic() + reset
+            if status == 429:
+                self.successes = 0
+                now = time.monotonic()
+                if now - self.decreasedAt >= DECREASE_COOLDOWN:
+                    self.decreasedAt = now
+                    self.bucket.setRate(max(MIN_RPS, self.bucket.rate / 2))
+                if retryAfter is not None:
+                    self.pausedUntil = max(
+                        self.pausedUntil, time.monotonic() + retryAfter
+                    )
+            elif status < 400:
+                self.successes += 1
+                if self.successes >= INCREASE_EVERY and self.bucket.rate < self.maxRps:
+                    self.successes = 0
+                    step = max(MIN_RPS, self.bucket.rate * INCREASE_FACTOR)
+                    self.bucket.setRate(min(self.maxRps, self.bucket.rate + step))
+        return retryAfter
+
+
+# One limiter per process, shared by every API call site.
+_limiter = AdaptiveLimiter(DEFAULT_RPS)
+
+
+# Set by cancel(): every acquire() raises Cancelled until resetCancel().
+_cancelled = threading.Event()
+
+
+class Cancelled(Exception):
+    """API requests were stopped by cancel(), e.g. on a daemon job timeout."""
+
+
+def configure(
+    rps,
+    quotaReserve=DEFAULT_QUOTA_RESERVE,
+    maxQuotaWait=DEFAULT_MAX_QUOTA_WAIT,
+):
+    """
+    Replace the limiter. Unchanged settings keep the current one, so runs
+    in a long-lived process start from the learned rate and quota.
+    """
+    global _limiter
+    current = tuple(
+        getattr(_limiter, name, None)
+        for name in ("maxRps", "quotaReserve", "maxQuotaWait")
+    )
+    if current == (float(rps), quotaReserve, maxQuotaWait):
+        return
+    _limiter = AdaptiveLimiter(rps, quotaReserve, maxQuotaWait)
+
+
+def configureFromArgs(args):
+    configure(args.rps, args.quota_reserve, args.max_quota_wait)
+
+
+def useLimiter(limiter):
+    """
+    Use a limiter shared with other processes, e.g. a multiprocessing
+    manager proxy of an AdaptiveLimiter, so they all stay under one rate
+    and one quota.
+    """
+    global _limiter
+    _limiter = limiter
+
+
+def acquire():
+    if _cancelled.is_set():
+        raise Cancelled("API requests were cancelled")
+    _limiter.acquire()
+
+
+def cancel():
+    _cancelled.set()
+
+
+def resetCancel():
+    _cancelled.clear()
+
+
+def onResponse(status, headers):
+    return _limiter.onResponse(status, headers)
+
+
+def addRateArgs(parser):
+    parser.add_argument(
+        "--rps",
+        type=float,
+        default=DEFAULT_RPS,
+        help="max API requests per second, shared by all workers; "
+        + "lowered automatically while the API answers 429",
+    )
+    parser.add_argument(
+        "--quota-reserve",
+        type=int,
+        default=DEFAULT_QUOTA_RESERVE,
+        help="stop when this many requests of the plan quota are left",
+    )
+    parser.add_argument(
+        "--max-quota-wait",
+        type=float,
+        default=DEFAULT_MAX_QUOTA_WAIT,
+        help="seconds to wait for a quota reset before stopping",
+    )
@@ -0,0 +1,267 @@
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import marked_registry
+from property_parser import PropertyRecord
+
+logger = logging.getLogger("my_logger")
+
+STATE_FILE = "refresh.sqlite"
+
+# Score weights, in "days of staleness" units.
+DAY = 24 * 60 * 60
+# Staleness of a listing never fetched (or fetched before this state existed).
+NEVER_FETCHED_DAYS = 30
+# A price or status change counts this much, halving every VOLATILITY_HALF_LIFE.
+VOLATILITY_WEIGHT = 3
+VOLATILITY_HALF_LIFE = 14 * DAY
+# Search results already show a change (or a new listing): the stored row is wrong.
+CHANGED_BONUS = 60
+MARKED_BONUS = 30
+# Each run a listing was deferred makes it more urgent.
+DEFERRED_WEIGHT = 2
+# With a budget, unchanged listings fetched more recently than this are not
+# worth a call.
+MIN_REFRESH_AGE = DAY
+
+
+class RefreshState:
+    """
+    SQLite record of when each zpid was last fetched, how often it changed
+    and what was deferred.
+    """
+
+    def __init__(self, path=STATE_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS refresh (
+                zpid TEXT PRIMARY KEY,
+                lastFetchedAt REAL,
+                lastPrice TEXT,
+                lastStatus TEXT,
+                volatility REAL NOT NULL DEFAULT 0,
+                volatilityAt REAL,
+                deferredSince REAL,
+                deferredRuns INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self.conn.commit()
+
+    def rows(self, zpids):
+        zpids = [str(zpid) for zpid in zpids]
+        rows = {}
+        with self.lock:
+            # Chunked, SQLite limits the number of bound parameters.
+            for start in range(0, len(zpids), 500):
+                chunk = zpids[start : start + 500]
+                for row in self.conn.execute(
+                    "SELECT zpid, lastFetchedAt, lastPrice, lastStatus, volatility, "
+                    + "volatilityAt, deferredRuns FROM refresh "
+                    + f"WHERE zpid IN ({', '.join('?' for _ in chunk)})",
+                    chunk,
+                ):
+                    rows[row[0]] = row
+        return rows
+
+    def recordFetch(self, zpid, price, status, now=None):
+        """
+        Store a fresh fetch; a price or status different from last time adds
+        volatility.
+        """
+        now = now or time.time()
+        price = None if price is None else str(price)
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT lastFetchedAt, lastPrice, lastStatus, volatility, volatilityAt "
+                + "FROM refresh WHERE zpid = ?",
+                (str(zpid),),
+            ).fetchone()
+            volatility = 0.0
+            if row is not None:
+                fetchedAt, lastPrice, lastStatus, volatility, volatilityAt = row
+                volatility = decay(volatility, volatilityAt, now)
+                if fetchedAt is not None and (lastPrice, lastStatus) != (price, status):
+                    volatility += 1
+            self.conn.execute(
+                """INSERT INTO refresh (zpid, lastFetchedAt, lastPrice, lastStatus,
+                    volatility, volatilityAt, deferredSince, deferredRuns)
+                VALUES (?, ?, ?, ?, ?, ?, NULL, 0)
+                ON CONFLICT(zpid) DO UPDATE SET
+                    lastFetchedAt = excluded.lastFetchedAt,
+                    lastPrice = excluded.lastPrice,
+                    lastStatus = excluded.lastStatus,
+                    volatility = excluded.volatility,
+                    volatilityAt = excluded.volatilityAt,
+                    deferredSince = NULL,
+                    deferredRuns = 0""",
+                (str(zpid), now, price, status, volatility, now),
+            )
+
+    def recordDeferred(self, zpids, now=None):
+        now = now or time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """INSERT INTO refresh (zpid, deferredSince, deferredRuns)
+                VALUES (?, ?, 1)
+                ON CONFLICT(zpid) DO UPDATE SET
+                    deferredSince = COALESCE(deferredSince, excluded.deferredSince),
+                    deferredRuns = deferredRuns + 1""",
+                [(str(zpid), now) for zpid in zpids],
+            )
+
+    def deferred(self):
+        """
+        [(zpid, deferredSince, deferredRuns)] still waiting for a refresh,
+        longest first.
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT zpid, deferredSince, deferredRuns FROM refresh "
+                + "WHERE deferredRuns > 0 ORDER BY deferredSince, zpid"
+            ).fetchall()
+
+
+def owesDetail(row):
+    """Whether an earlier run deferred the zpid of a state row, or never fetched it."""
+    return row is not None and (row[6] > 0 or row[1] is None)
+
+
+def decay(volatility, volatilityAt, now):
+    if not volatility or volatilityAt is None:
+        return 0.0
+    return volatility * math.pow(0.5, (now - volatilityAt) / VOLATILITY_HALF_LIFE)
+
+
+class RefreshScheduler:
+    """
+    Pick which zpids get a /property call this run. Every candidate is
+    scored by staleness (days since its last fetch), volatility (recent
+    price/status changes), whether the search results already show a
+    change, whether it is a marked house and how often it was deferred;
+    the budget goes to the highest scores and the rest is recorded as
+    deferred. budget=None refreshes every candidate. Without a state
+    (no budget was ever set) nothing is recorded or owed.
+    """
+
+    def __init__(self, state, budget=None, markedZpids=()):
+        self.state = state
+        self.budget = budget
+        self.markedZpids = {str(zpid) for zpid in markedZpids}
+
+    @property
+    def limited(self):
+        return self.budget is not None
+
+    def score(self, zpid, changed, row, now):
+        # A deferred listing's row only has its search fields: as stale as a change.
+        changed = changed or owesDetail(row)
+        fetchedAt = row[1] if row is not None else None
+        staleness = NEVER_FETCHED_DAYS if fetchedAt is None else (now - fetchedAt) / DAY
+        volatility = decay(row[4], row[5], now) if row is not None else 0.0
+        deferredRuns = row[6] if row is not None else 0
+        return (
+            staleness
+            + VOLATILITY_WEIGHT * volatility
+            + (CHANGED_BONUS if changed else 0)
+            + (MARKED_BONUS if str(zpid) in self.markedZpids else 0)
+            + DEFERRED_WEIGHT * deferredRuns
+        )
+
+    def isDue(self, zpid, row, now):
+        """Whether an unchanged listing is old enough to spend budget on."""
+        return row is None or row[1] is None or now - row[1] >= MIN_REFRESH_AGE
+
+    def plan(self, candidates, now=None):
+        """
+        candidates: (zpid, changed) pairs in output order. Return the zpids
+        to fetch, in that same order, and record the others as deferred.
+        """
+        candidates = [(str(zpid), changed) for zpid, changed in candidates]
+        if self.budget is None or len(candidates) <= self.budget:
+            return [zpid for zpid, _ in candidates]
+        now = now or time.time()
+        rows = self.state.rows(zpid for zpid, _ in candidates)
+        ranked = sorted(
+            candidates,
+            key=lambda item: -self.score(item[0], item[1], rows.get(item[0]), now),
+        )
+        chosen = {zpid for zpid, _ in ranked[: self.budget]}
+        deferred = [zpid for zpid, _ in ranked[self.budget :]]
+        self.state.recordDeferred(deferred, now)
+        logger.info(
+            f"refresh budget {self.budget}: {len(chosen)} of {len(candidates)} "
+            + f"listings refreshed, {len(deferred)} deferred"
+        )
+        return [zpid for zpid, _ in candidates if zpid in chosen]
+
+    def owed(self, zpids):
+        """zpids an earlier run deferred, or never fetched, in order."""
+        if self.state is None:
+            return []
+        rows = self.state.rows(zpids)
+        return [zpid for zpid in zpids if owesDetail(rows.get(str(zpid)))]
+
+    def dueUnchanged(self, zpids, now=None):
+        """Unchanged zpids worth considering for a refresh, in order."""
+        now = now or time.time()
+        rows = self.state.rows(zpids)
+        return [zpid for zpid in zpids if self.isDue(zpid, rows.get(str(zpid)), now)]
+
+    def recordRecord(self, record):
+        """Remember a fetched PropertyRecord (or a journaled list of its fields)."""
+        record = PropertyRecord._make(record)
+        if self.state is not None:
+            self.state.recordFetch(record.zpid, record.price, record.homeStatus)
+        return record
+
+
+def addSchedulerArgs(parser):
+    parser.add_argument(
+        "--budget",
+        type=int,
+        help="max /property calls this run, spent on the most valuable refreshes",
+    )
+    parser.add_argument(
+        "--refresh-state", default=STATE_FILE, help="refresh scheduler sqlite state"
+    )
+
+
+def configureFromArgs(args, markedZpids=None):
+    """markedZpids defaults to the houses of the shared registry, if there is one."""
+    if markedZpids is None:
+        markedZpids = []
+        if os.path.isfile(marked_registry.REGISTRY_FILE):
+            markedZpids = marked_registry.MarkedRegistry().zpids()
+    state = None
+    # The state is created by the first budgeted run; once it exists every
+    # run keeps it current, so what was deferred is caught up without one.
+    if args.budget is not None or os.path.isfile(args.refresh_state):
+        state = RefreshState(args.refresh_state)
+    return RefreshScheduler(state, args.budget, markedZpids)
+
+
+def main(args):
+    if not os.path.isfile(args.refresh_state):
+        return
+    state = RefreshState(args.refresh_state)
+    for zpid, deferredSince, deferredRuns in state.deferred():
+        since = time.strftime("%Y-%m-%d %H:%M", time.localtime(deferredSince))
+        print(f"{zpid}\tdeferred {deferredRuns} runs since {since}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List zpids whose refresh was deferred"
+    )
+    parser.add_argument(
+        "--refresh-state", default=STATE_FILE, help="refresh scheduler sqlite state"
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing.managers import BaseManager
+from typing import NamedTuple
+
+import api_client
+import crawl_journal
+import get_zillow_data
+import metrics
+import rate_limiter
+import response_archive
+import response_cache
+import script_log
+from csv_stream import writeCsvStream
+from fetcher import addConcurrencyArgs, fetchStream
+from property_parser import DETAIL_FIELDS
+
+logger = script_log.getLogger()
+
+DEFAULT_REGIONS_FILE = "regions.json"
+REGION_FIELDS = DETAIL_FIELDS + ["state", "region"]
+DATASETS = {"ForSale": "region_forsale", "RecentlySold": "region_sold"}
+
+
+class Shard(NamedTuple):
+    """One city of a region, crawled by one worker process."""
+
+    region: str
+    state: str
+    city: str
+
+
+def loadRegions(regionsFile, names=None):
+    """
+    Shards of a regions.json, in file order:
+
+        {"regions": [{"name": "bay_area", "state": "CA", "cities": ["Fremont"]}]}
+
+    names limits them to the regions with those names.
+    """
+    with open(regionsFile) as file:
+        config = json.load(file)
+    shards = []
+    for region in config["regions"]:
+        if names is not None and region["name"] not in names:
+            continue
+        for city in region["cities"]:
+            shards.append(Shard(region["name"], region["state"], city))
+    if names is not None:
+        unknown = set(names) - {shard.region for shard in shards}
+        if unknown:
+            raise Exception(f"unknown regions in {regionsFile}: {sorted(unknown)}")
+    if len(set(shards)) != len(shards):
+        raise Exception(f"{regionsFile} lists a city twice in the same region")
+    return shards
+
+
+class DedupeSet:
+    """zpids already claimed by a shard, shared by the worker processes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.zpids = set()
+
+    def claim(self, zpids):
+        """Return the zpids no shard has claimed yet, now claimed by the caller."""
+        claimed = []
+        with self.lock:
+            for zpid in zpids:
+                if zpid not in self.zpids:
+                    self.zpids.add(zpid)
+                    claimed.append(zpid)
+        return claimed
+
+
+class CrawlManager(BaseManager):
+    """Serves the limiter and dedupe set every worker process goes through."""
+
+
+CrawlManager.register("AdaptiveLimiter", rate_limiter.AdaptiveLimiter)
+CrawlManager.register("DedupeSet", DedupeSet)
+
+# Set in each worker process by initWorker.
+_dedupe = None
+_args = None
+
+
+def initWorker(limiter, dedupe, args):
+    global _dedupe, _args
+    _dedupe = dedupe
+    _args = args
+    rate_limiter.useLimiter(limiter)
+    api_client.configure(args.concurrency)
+    response_cache.configureFromArgs(args)
+
+
+def shardRunName(args, shard):
+    return f"region_{args.status}_{args.days}_{shard.region}_{shard.state}_{shard.city}"
+
+
+def searchQuery(statusType, days):
+    querystring = {
+        "home_type": "Houses",
+        "bedsMin": 3,
+        "sort": "Price_High_Low",
+        "status_type": statusType,
+    }
+    if statusType == "RecentlySold":
+        querystring["soldInLast"] = str(days)
+    return querystring
+
+
+def crawlShard(shard, workDir):
+    """
+    Search one city and fetch the details of the listings no other shard
+    claimed. Runs in a worker process; returns (shard file, rows, skipped
+    duplicates). The shard's journal is kept until the merge succeeded.
+    """
+    runName = shardRunName(_args, shard)
+    metrics.configureFromArgs(_args, runName)
+    response_archive.configureFromArgs(_args)
+    journal = crawl_journal.configure(runName, _args.resume)
+    duplicates = 0
+
+    def claimedZpids():
+        nonlocal duplicates
+        pages = get_zillow_data.searchAllPages(
+            searchQuery(_args.status, _args.days),
+            shard.city,
+            _args.concurrency,
+            shard.state,
+        )
+        for _, props in pages:
+            zpids = [str(prop["zpid"]) for prop in props]
+            claimed = _dedupe.claim(zpids)
+            duplicates += len(zpids) - len(claimed)
+            yield from claimed
+
+    def iterRows():
+        details = fetchStream(
+            get_zillow_data.getDetailByZpid, claimedZpids(), _args.concurrency
+        )
+        for record in details:
+            yield list(record) + [shard.state, shard.region]
+
+    shardFile = os.path.join(workDir, f"{runName}.csv")
+    try:
+        rowCount = writeCsvStream(iterRows(), shardFile, REGION_FIELDS)
+    finally:
+        journal.close()
+        response_archive.finish()
+        metrics.finish()
+    return shardFile, rowCount, duplicates
+
+
+def mergeShards(shardFiles, outputFile):
+    """Concatenate shard csv files, in the given order, under one header."""
+    with open(outputFile, "w", newline="", encoding="utf-8") as output:
+        for idx, shardFile in enumerate(shardFiles):
+            with open(shardFile, newline="", encoding="utf-8") as file:
+                header = file.readline()
+                if idx == 0:
+                    output.write(header)
+                shutil.copyfileobj(file, output)
+
+
+def crawlRegions(shards, args):
+    """
+    Crawl shards on a process pool and merge them into one csv, in shard
+    order. All workers draw from one AdaptiveLimiter (rate, 429 backoff and
+    quota are shared) and one DedupeSet, so a listing showing up in the
+    search results of several cities is fetched once.
+    """
+    workers = min(args.workers or os.cpu_count() or 1, len(shards))
+    formatted_date = datetime.now().strftime("%y%m%d")
+    outputFile = f"{DATASETS[args.status]}_{formatted_date}.csv"
+    with CrawlManager() as manager, tempfile.TemporaryDirectory(
+        prefix=".region_", dir="."
+    ) as workDir:
+        limiter = manager.AdaptiveLimiter(
+            args.rps, args.quota_reserve, args.max_quota_wait
+        )
+        dedupe = manager.DedupeSet()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=initWorker,
+            initargs=(limiter, dedupe, args),
+        ) as executor:
+            futures = [executor.submit(crawlShard, shard, workDir) for shard in shards]
+            results = []
+            for shard, future in zip(shards, futures):
+                # Raises the first failed shard's error once the others ended;
+                # their journals make a --resume rerun skip the finished work.
+                shardFile, rowCount, duplicates = future.result()
+                logger.info(
+                    f"{shard.region} {shard.city}, {shard.state}: {rowCount} rows, "
+                    + f"{duplicates} listings left to other shards"
+                )
+                results.append(shardFile)
+        mergeShards(results, outputFile)
+    for shard in shards:
+        crawl_journal.CrawlJournal(
+            crawl_journal.journalPath(shardRunName(args, shard))
+        ).finish()
+    return outputFile
+
+
+@script_log.logsTo("region_crawl.log")
+def main(args):
+    if args.status not in DATASETS:
+        raise Exception(f"Incorrect status: {args.status}")
+    names = args.regions.split(",") if args.regions else None
+    shards = loadRegions(args.config, names)
+    logger.info(f"crawling {len(shards)} cities of {args.config}")
+    outputFile = crawlRegions(shards, args)
+    logger.info(f"{outputFile} is created")
+    # Imported here like get_zillow_data does, pandas is not needed to crawl.
+    import snapshot_store
+
+    snapshot_store.writeSnapshotFromCsv(
+        DATASETS[args.status], outputFile, datetime.now().strftime("%Y-%m-%d")
+    )
+    return outputFile
+
+
+def addArgs(parser):
+    parser.add_argument(
+        "--config",
+        default=DEFAULT_REGIONS_FILE,
+        help="json file of the regions to crawl, each a state and its cities",
+    )
+    parser.add_argument("--regions", help="comma list of region names, default: all")
+    parser.add_argument("--status", default="ForSale", help="[ForSale|RecentlySold]")
+    parser.add_argument(
+        "--days", default=7, help="recent sold days, only used for RecentlySold option"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="worker processes, each crawling one city at a time; default: cpu count",
+    )
+    addConcurrencyArgs(parser)
+    crawl_journal.addResumeArgs(parser)
+    response_cache.addCacheArgs(parser)
+    response_archive.addArchiveArgs(parser)
+    metrics.addMetricsArgs(parser)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Crawl the cities of several states on a pool of processes"
+    )
+    addArgs(parser)
+    args = parser.parse_args()
+    try:
+        main(args)
+    except rate_limiter.QuotaExhausted as e:
+        logger.error(f"Stopped, API quota exhausted: {e}; rerun with --resume once it resets")
+        sys.exit(2)
@@ -0,0 +1,404 @@
+import argparse
+import atexit
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from csv_stream import writeCsvStream
+from property_parser import DETAIL_FIELDS, loads, parseProperty
+
+try:
+    import zstandard
+except ImportError:  # gzip is always available
+    zstandard = None
+
+logger = logging.getLogger("my_logger")
+
+ARCHIVE_DIR = "archive"
+INDEX_DB_NAME = "index.sqlite"
+SEARCH_ENDPOINT = "/propertyExtendedSearch"
+DETAIL_ENDPOINT = "/property"
+# Flush compressed output (and commit the index) every this many lines, so
+# a killed crawl loses at most a few responses.
+FLUSH_EVERY = 100
+
+
+def partitionDir(endpoint, day, archiveDir=ARCHIVE_DIR):
+    """archive/<endpoint>/day=<YYYY-MM-DD>, e.g. archive/property/day=2023-10-01."""
+    return os.path.join(archiveDir, endpoint.strip("/"), f"day={day}")
+
+
+def openText(path, mode):
+    """Open a .jsonl.zst or .jsonl.gz archive file for text "r" or "w"."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise Exception(f"zstandard is required to read {path}")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+
+
+def readLines(path):
+    """Yield (lineNo, entry) from an archive file, tolerating a cut-off tail."""
+    with openText(path, "r") as file:
+        try:
+            for lineNo, line in enumerate(file):
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    # The last line may be cut short if the run was killed.
+                    continue
+                yield lineNo, entry
+        except (EOFError, zlib.error):
+            logger.warning(f"{path} ends early, the run writing it was killed")
+
+
+def responseZpids(endpoint, params, responseJson):
+    if endpoint == SEARCH_ENDPOINT:
+        return [str(prop["zpid"]) for prop in responseJson.get("props", [])]
+    if "zpid" in (params or {}):
+        return [str(params["zpid"])]
+    return []
+
+
+class ResponseArchive:
+    """
+    Append-only, compressed JSONL files of raw API responses, one file per
+    endpoint, day and process, plus an SQLite index of which file line
+    mentions which zpid. Nothing is ever rewritten.
+    """
+
+    def __init__(self, archiveDir=ARCHIVE_DIR, compression=None):
+        self.archiveDir = archiveDir
+        self.extension = compression or ("zst" if zstandard is not None else "gz")
+        self.lock = threading.Lock()
+        self.files = {}
+        self.pending = 0
+        # Index rows are inserted at flush time in one short transaction, so
+        # several processes appending to the same archive do not hold the
+        # SQLite write lock between flushes.
+        self.pendingRows = []
+        os.makedirs(archiveDir, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(archiveDir, INDEX_DB_NAME),
+            timeout=30,
+            check_same_thread=False,
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                zpid TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                day TEXT NOT NULL,
+                file TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                fetchedAt REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_zpid ON responses (zpid, endpoint)"
+        )
+        self.conn.commit()
+
+    def _writer(self, endpoint, day):
+        key = (endpoint, day)
+        if key not in self.files:
+            directory = partitionDir(endpoint, day, self.archiveDir)
+            os.makedirs(directory, exist_ok=True)
+            fileName = f"part-{time.time_ns()}-{os.getpid()}.jsonl.{self.extension}"
+            path = os.path.join(directory, fileName)
+            self.files[key] = [openText(path, "w"), path, 0]
+        return self.files[key]
+
+    def append(self, endpoint, params, body, responseJson):
+        """Archive one response; body is its raw text, responseJson the decoded body."""
+        fetchedAt = time.time()
+        day = datetime.now().strftime("%Y-%m-%d")
+        if "\n" in body:
+            body = json.dumps(responseJson)
+        line = (
+            f'{{"fetchedAt": {fetchedAt}, "endpoint": {json.dumps(endpoint)}, '
+            + f'"params": {json.dumps(params)}, "body": {body}}}\n'
+        )
+        zpids = responseZpids(endpoint, params, responseJson)
+        with self.lock:
+            writer = self._writer(endpoint, day)
+            file, path, lineNo = writer
+            file.write(line)
+            writer[2] += 1
+            relPath = os.path.relpath(path, self.archiveDir)
+            self.pendingRows.extend(
+                (zpid, endpoint, day, relPath, lineNo, fetchedAt) for zpid in zpids
+            )
+            self.pending += 1
+            if self.pending >= FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        for file, _, _ in self.files.values():
+            file.flush()
+        if self.pendingRows:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)", self.pendingRows
+                )
+            self.pendingRows = []
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            for file, _, _ in self.files.values():
+                file.close()
+            self.files = {}
+
+    def filesFor(self, endpoint, day):
+        directory = partitionDir(endpoint, day, self.archiveDir)
+        if not os.path.isdir(directory):
+            return []
+        return [
+            os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.startswith("part-")
+        ]
+
+    def iterResponses(self, endpoint, day):
+        """Yield the archived entries of one endpoint and day in fetch order."""
+        for path in self.filesFor(endpoint, day):
+            for _, entry in readLines(path):
+                yield entry
+
+    def latestLocations(self, endpoint, zpids, untilDay):
+        """{zpid: (file, line)} of the newest response per zpid up to untilDay."""
+        zpids = list(dict.fromkeys(str(zpid) for zpid in zpids))
+        locations = {}
+        with self.lock:
+            self._flush()
+            # Chunked, SQLite limits the number of bound parameters. The
+            # other columns of a MAX() row come from the row holding the max.
+            for start in range(0, len(zpids), 500):
+                chunk = zpids[start : start + 500]
+                for zpid, file, line, _ in self.conn.execute(
+                    "SELECT zpid, file, line, MAX(fetchedAt) FROM responses "
+                    + "WHERE endpoint = ? AND day <= ? "
+                    + f"AND zpid IN ({', '.join('?' for _ in chunk)}) GROUP BY zpid",
+                    [endpoint, untilDay, *chunk],
+                ):
+                    locations[zpid] = (file, line)
+        return locations
+
+    def readEntries(self, locations):
+        """{key: entry} for {key: (file, line)}, reading each file once."""
+        byFile = {}
+        for key, (file, line) in locations.items():
+            byFile.setdefault(file, {})[line] = key
+        entries = {}
+        for file, lines in byFile.items():
+            for lineNo, entry in readLines(os.path.join(self.archiveDir, file)):
+                if lineNo in lines:
+                    entries[lines[lineNo]] = entry
+        return entries
+
+    def history(self, zpid):
+        """Every archived response mentioning zpid, oldest first."""
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(
+                "SELECT file, line FROM responses WHERE zpid = ? ORDER BY fetchedAt",
+                (str(zpid),),
+            ).fetchall()
+        entries = self.readEntries({idx: row for idx, row in enumerate(rows)})
+        return [entries[idx] for idx in sorted(entries)]
+
+
+# Shared by every API call site; None means archiving is disabled.
+_archive = None
+
+
+def configure(archiveDir=ARCHIVE_DIR, enabled=True):
+    global _archive
+    if _archive is not None:
+        _archive.close()
+    _archive = ResponseArchive(archiveDir) if enabled else None
+    if _archive is not None:
+        atexit.register(_archive.close)
+
+
+def finish():
+    """Close the archive now rather than at exit, e.g. in a pool worker process."""
+    global _archive
+    if _archive is not None:
+        atexit.unregister(_archive.close)
+        _archive.close()
+        _archive = None
+
+
+def enabled():
+    return _archive is not None
+
+
+def append(endpoint, params, body, responseJson):
+    if _archive is not None:
+        _archive.append(endpoint, params, body, responseJson)
+
+
+def addArchiveArgs(parser):
+    parser.add_argument(
+        "--archive-dir",
+        default=ARCHIVE_DIR,
+        help="directory of the raw API response archive",
+    )
+    parser.add_argument(
+        "--no-archive", action="store_true", help="do not archive API responses"
+    )
+
+
+def configureFromArgs(args):
+    configure(args.archive_dir, enabled=not args.no_archive)
+
+
+def searchPages(archive, day, statusType, cities):
+    """
+    (city, props) of the archived search pages of a day for cities, in
+    crawl order: the order of the cities list, then page order. Pages are
+    archived as they arrive, which interleaves the cities.
+    """
+    cityOrder = {city: idx for idx, city in enumerate(cities)}
+    pages = {}
+    for entry in archive.iterResponses(SEARCH_ENDPOINT, day):
+        params = entry["params"]
+        if params.get("status_type") != statusType:
+            continue
+        city = params.get("location", "").split(",")[0]
+        if city not in cityOrder:
+            continue
+        # A page fetched twice (e.g. a rerun) keeps its latest copy.
+        pages[(city, int(params.get("page", 1)))] = entry["body"].get("props", [])
+    for city, page in sorted(pages, key=lambda key: (cityOrder[key[0]], key[1])):
+        yield city, pages[(city, page)]
+
+
+def searchProps(archive, day, statusType, cities):
+    """(city, prop) of the archived search results of a day, as searchPages."""
+    for city, props in searchPages(archive, day, statusType, cities):
+        for prop in props:
+            yield city, prop
+
+
+def rebuildDetails(archive, zpids, day):
+    """PropertyRecords of zpids from their newest /property response up to day."""
+    locations = archive.latestLocations(DETAIL_ENDPOINT, zpids, day)
+    entries = archive.readEntries(locations)
+    missing = 0
+    for zpid in zpids:
+        entry = entries.get(zpid)
+        if entry is None:
+            missing += 1
+            continue
+        yield parseProperty(zpid, entry["body"])
+    if missing:
+        print(f"{missing} zpids have no archived /property response")
+
+
+def rebuild(args):
+    archive = ResponseArchive(args.archive_dir)
+    yymmdd = datetime.strptime(args.date, "%Y-%m-%d").strftime("%y%m%d")
+    if args.dataset != "detail" and not args.cities:
+        raise Exception(f"rebuilding {args.dataset} needs the crawl's --cities")
+    cities = args.cities.split(",") if args.cities else []
+    if args.dataset == "basic":
+        # Imported here, rebuilding detail outputs needs no search code.
+        from get_zillow_data import basicBatches, writeBasicCsv
+
+        outputFile = args.output or f"{args.status.lower()}_{yymmdd}_basic.csv"
+        rowCount = writeBasicCsv(
+            basicBatches(searchPages(archive, args.date, args.status, cities)),
+            outputFile,
+        )
+        print(f"{outputFile} is created with {rowCount} rows")
+        return
+    if args.dataset == "detail":
+        if args.zpids:
+            zpids = args.zpids.split(",")
+        else:
+            zpids = list(
+                dict.fromkeys(
+                    str(entry["params"]["zpid"])
+                    for entry in archive.iterResponses(DETAIL_ENDPOINT, args.date)
+                )
+            )
+        outputFile = args.output or f"detail_{yymmdd}.csv"
+        rows = rebuildDetails(archive, zpids, args.date)
+        fieldnames = DETAIL_FIELDS
+    else:
+        statusType = "ForSale" if args.dataset == "forsale" else "RecentlySold"
+        zpids = list(
+            dict.fromkeys(
+                str(prop["zpid"])
+                for _, prop in searchProps(archive, args.date, statusType, cities)
+            )
+        )
+        outputFile = args.output or f"{args.dataset}_{yymmdd}.csv"
+        rows = rebuildDetails(archive, zpids, args.date)
+        fieldnames = DETAIL_FIELDS
+    rowCount = writeCsvStream(rows, outputFile, fieldnames)
+    print(f"{outputFile} is created with {rowCount} rows")
+    if args.store and args.dataset in ("forsale", "sold"):
+        import snapshot_store
+
+        path = snapshot_store.writeSnapshotFromCsv(
+            args.dataset, outputFile, args.date, args.store
+        )
+        print(f"{outputFile} is imported into {path}")
+
+
+def show(args):
+    archive = ResponseArchive(args.archive_dir)
+    for entry in archive.history(args.zpid):
+        print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-derive outputs from the raw API response archive"
+    )
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuildParser = commands.add_parser(
+        "rebuild", help="regenerate a csv from archived responses, no API calls"
+    )
+    rebuildParser.add_argument(
+        "dataset", choices=["forsale", "sold", "basic", "detail"]
+    )
+    rebuildParser.add_argument("--date", required=True, help="YYYY-MM-DD crawl day")
+    rebuildParser.add_argument(
+        "--status", default="ForSale", help="[ForSale|RecentlySold], basic only"
+    )
+    rebuildParser.add_argument(
+        "--cities",
+        help="comma separated, as given to the crawl; forsale, sold and basic only",
+    )
+    rebuildParser.add_argument("--zpids", help="comma separated, detail only")
+    rebuildParser.add_argument("--output", help="csv file, default as the crawler")
+    rebuildParser.add_argument(
+        "--store", help="also write forsale/sold into this snapshot store"
+    )
+    rebuildParser.set_defaults(func=rebuild)
+    showParser = commands.add_parser(
+        "show", help="print every archived response of a zpid"
+    )
+    showParser.add_argument("zpid")
+    showParser.set_defaults(func=show)
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".cache"
+CACHE_DB_NAME = "responses.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Seconds a cached response stays valid, per API endpoint.
+ENDPOINT_TTLS = {
+    "/propertyExtendedSearch": 60 * 60,
+    "/property": 12 * 60 * 60,
+    "/images": 7 * 24 * 60 * 60,
+}
+DEFAULT_TTL = 60 * 60
+# Expired entries are dropped every this many writes; get() already ignores them.
+EVICT_EVERY = 200
+# A full cache is trimmed to this share of maxBytes, so the next writes do
+# not each trigger an eviction.
+EVICT_TO = 0.9
+
+
+def makeKey(endpoint, params):
+    """Normalize the query params so that key order and int/str zpids hit the same entry."""
+    normalized = {str(k): str(v) for k, v in (params or {}).items()}
+    return f"{endpoint}?{json.dumps(normalized, sort_keys=True)}"
+
+
+class ResponseCache:
+    def __init__(self, cacheDir=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cacheDir, exist_ok=True)
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        # timeout: wait for other processes holding the write lock.
+        self.conn = sqlite3.connect(
+            os.path.join(cacheDir, CACHE_DB_NAME), timeout=30, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                createdAt REAL NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_createdAt ON responses (createdAt)"
+        )
+        self.conn.commit()
+        self.writes = 0
+        # Upper bound of the cache size: replaced entries are counted twice
+        # until the next eviction measures it again.
+        self.totalBytes = self._size()
+
+    def _size(self):
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, endpoint, params):
+        key = makeKey(endpoint, params)
+        ttl = ENDPOINT_TTLS.get(endpoint, DEFAULT_TTL)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, createdAt FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, endpoint, params, body):
+        key = makeKey(endpoint, params)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, body, len(body), time.time()),
+            )
+            self.conn.commit()
+            self.writes += 1
+            self.totalBytes += len(body)
+            if self.writes % EVICT_EVERY == 0 or self.totalBytes > self.maxBytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones if the cache outgrew maxBytes."""
+        now = time.time()
+        for endpoint, ttl in ENDPOINT_TTLS.items():
+            self.conn.execute(
+                "DELETE FROM responses WHERE endpoint = ? AND createdAt < ?",
+                (endpoint, now - ttl),
+            )
+        totalBytes = self._size()
+        if totalBytes > self.maxBytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY createdAt"
+            ).fetchall()
+            staleKeys = []
+            for key, size in rows:
+                if totalBytes <= self.maxBytes * EVICT_TO:
+                    break
+                staleKeys.append((key,))
+                totalBytes -= size
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", staleKeys)
+        self.conn.commit()
+        self.totalBytes = totalBytes
+
+
+# Shared by every API call site; None means caching is disabled.
+_cache = None
+
+
+def configure(cacheDir=DEFAULT_CACHE_DIR, enabled=True):
+    global _cache
+    if enabled and _cache is not None and _cache.cacheDir == cacheDir:
+        return
+    _cache = ResponseCache(cacheDir) if enabled else None
+
+
+def enabled():
+    return _cache is not None
+
+
+def get(endpoint, params):
+    return _cache.get(endpoint, params) if _cache is not None else None
+
+
+def store(endpoint, params, body):
+    if _cache is not None:
+        _cache.set(endpoint, params, body)
+
+
+def addCacheArgs(parser):
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="directory of the on-disk API response cache",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always query the API"
+    )
+
+
+def configureFromArgs(args):
+    configure(args.cache_dir, enabled=not args.no_cache)
@@ -0,0 +1,348 @@
+import argparse
+import json
+import shlex
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import FrozenSet, NamedTuple, Optional
+
+import dreamhouse
+import metrics
+import profiler
+import rate_limiter
+import script_log
+
+logger = script_log.getLogger()
+
+DEFAULT_CONFIG_FILE = "daemon.json"
+DEFAULT_STATUS_PORT = 8089
+# Seconds between scheduling passes.
+TICK = 1.0
+# Seconds running jobs get to stop on SIGTERM before the daemon exits.
+SHUTDOWN_GRACE = 60
+
+
+class JobSpec(NamedTuple):
+    """
+    One configured job: a dreamhouse command line run every `every`
+    seconds, daily at `at` ("HH:MM", local time), or after job `after`
+    succeeded.
+    """
+
+    name: str
+    argv: list
+    every: Optional[float]
+    at: Optional[str]
+    after: Optional[str]
+    timeout: Optional[float]
+    resources: FrozenSet[str]
+
+
+def parseJob(entry):
+    argv = entry["command"]
+    argv = shlex.split(argv) if isinstance(argv, str) else list(argv)
+    if not argv or argv[0] not in dreamhouse.COMMANDS or argv[0] == "daemon":
+        raise Exception(f"job {entry['name']}: unknown command {argv[:1]}")
+    schedules = [key for key in ("every", "at", "after") if entry.get(key) is not None]
+    if len(schedules) != 1:
+        raise Exception(f"job {entry['name']}: set exactly one of every, at, after")
+    if entry.get("at") is not None:
+        datetime.strptime(entry["at"], "%H:%M")
+    command = dreamhouse.COMMANDS[argv[0]]
+    return JobSpec(
+        name=entry["name"],
+        argv=argv,
+        every=entry.get("every"),
+        at=entry.get("at"),
+        after=entry.get("after"),
+        timeout=entry.get("timeout"),
+        # A job may add resources, never drop those guarding its command's state.
+        resources=frozenset(command.resources) | frozenset(entry.get("resources", ())),
+    )
+
+
+def loadConfig(configFile):
+    """JobSpecs of a daemon.json; every command line is parsed up front."""
+    with open(configFile) as file:
+        config = json.load(file)
+    specs = [parseJob(entry) for entry in config["jobs"]]
+    names = {spec.name for spec in specs}
+    if len(names) != len(specs):
+        raise Exception("job names must be unique")
+    for spec in specs:
+        if spec.after is not None and spec.after not in names:
+            raise Exception(f"job {spec.name}: runs after unknown job {spec.after}")
+        _, parser = dreamhouse.commandParser(spec.argv[0])
+        parser.parse_args(spec.argv[1:])
+    return config, specs
+
+
+def nextRunTime(spec, now):
+    """Epoch seconds of the next scheduled run after now, None for `after` jobs."""
+    if spec.every is not None:
+        return now + spec.every
+    if spec.at is not None:
+        hour, minute = (int(part) for part in spec.at.split(":"))
+        today = datetime.fromtimestamp(now)
+        runAt = today.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if runAt.timestamp() <= now:
+            runAt += timedelta(days=1)
+        return runAt.timestamp()
+    return None
+
+
+class Job:
+    def __init__(self, spec, now):
+        self.spec = spec
+        self.state = "idle"
+        # `every` jobs start right away, `at` jobs at their next time.
+        self.nextRun = now if spec.every is not None else nextRunTime(spec, now)
+        self.thread = None
+        self.startedAt = None
+        self.finishedAt = None
+        self.result = None
+        self.error = None
+        # Set by the job's thread, moved to result/error once it ended.
+        self.outcome = None
+        self.runs = 0
+        self.timedOut = False
+
+    def status(self, now):
+        return {
+            "name": self.spec.name,
+            "command": shlex.join(self.spec.argv),
+            "state": self.state,
+            "resources": sorted(self.spec.resources),
+            "runs": self.runs,
+            "lastResult": self.result,
+            "lastError": self.error,
+            "startedAt": _isoTime(self.startedAt),
+            "finishedAt": _isoTime(self.finishedAt),
+            "runningSeconds": (
+                round(now - self.startedAt, 1) if self.state == "running" else None
+            ),
+            "nextRun": _isoTime(self.nextRun),
+        }
+
+
+def _isoTime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+class Scheduler:
+    """
+    Run configured jobs in threads of this process, so imported modules,
+    the API connection pool, the rate limiter's learned rate and quota, the
+    response cache and the storage client stay warm between runs. Jobs run
+    in parallel unless they share a resource. A job over its timeout has its
+    API requests cancelled (work without API calls cannot be interrupted and
+    is reported as timed out when it ends); a failed or timed out job that
+    supports --resume resumes its crawl journal on the next run.
+    """
+
+    def __init__(self, specs):
+        now = time.time()
+        self.startedAt = now
+        self.lock = threading.Lock()
+        self.jobs = {spec.name: Job(spec, now) for spec in specs}
+        self.stopping = threading.Event()
+
+    def busyResources(self):
+        return {
+            resource
+            for job in self.jobs.values()
+            if job.state == "running"
+            for resource in job.spec.resources
+        }
+
+    def tick(self, now):
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == "running":
+                    self._checkRunning(job, now)
+            if self.stopping.is_set():
+                return
+            due = sorted(
+                (
+                    job
+                    for job in self.jobs.values()
+                    if job.state in ("idle", "waiting")
+                    and job.nextRun is not None
+                    and job.nextRun <= now
+                ),
+                key=lambda job: job.nextRun,
+            )
+            for job in due:
+                if job.spec.resources & self.busyResources():
+                    job.state = "waiting"
+                else:
+                    self._start(job, now)
+
+    def _checkRunning(self, job, now):
+        if not job.thread.is_alive():
+            self._finished(job, now)
+        elif (
+            job.spec.timeout is not None
+            and not job.timedOut
+            and now - job.startedAt > job.spec.timeout
+        ):
+            job.timedOut = True
+            logger.info(
+                f"{job.spec.name} is over its {job.spec.timeout}s timeout, cancelling"
+            )
+            if "api" in job.spec.resources:
+                rate_limiter.cancel()
+
+    def _start(self, job, now):
+        job.state = "running"
+        job.startedAt = now
+        job.finishedAt = None
+        job.timedOut = False
+        job.outcome = None
+        if job.spec.every is not None or job.spec.at is not None:
+            job.nextRun = nextRunTime(job.spec, now)
+        else:
+            job.nextRun = None
+        if "api" in job.spec.resources:
+            rate_limiter.resetCancel()
+        resume = job.result in ("failed", "timeout")
+        job.thread = threading.Thread(
+            target=self._run, args=(job, resume), name=job.spec.name, daemon=True
+        )
+        logger.info(f"start {job.spec.name}: {shlex.join(job.spec.argv)}")
+        job.thread.start()
+
+    def _run(self, job, resume):
+        args = None
+        try:
+            module, parser = dreamhouse.commandParser(job.spec.argv[0])
+            args = parser.parse_args(job.spec.argv[1:])
+            if resume and hasattr(args, "resume"):
+                args.resume = True
+            module.main(args)
+            job.outcome = ("timeout" if job.timedOut else "ok", None)
+        except rate_limiter.Cancelled:
+            job.outcome = ("timeout", None)
+        except BaseException as e:  # SystemExit too, a job never stops the daemon
+            job.outcome = ("failed", f"{type(e).__name__}: {e}")
+        finally:
+            if "api" in job.spec.resources:
+                metrics.finish()
+            if getattr(args, "profile", False):
+                profiler.finish()
+
+    def _finished(self, job, now):
+        job.result, job.error = job.outcome
+        job.state = "idle"
+        job.finishedAt = now
+        job.runs += 1
+        logger.info(
+            f"{job.spec.name} {job.result} after {now - job.startedAt:.0f}s"
+            + (f": {job.error}" if job.error else "")
+        )
+        if job.result == "ok":
+            for dependent in self.jobs.values():
+                if dependent.spec.after == job.spec.name:
+                    dependent.nextRun = now
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            return {
+                "startedAt": _isoTime(self.startedAt),
+                "now": _isoTime(now),
+                "busyResources": sorted(self.busyResources()),
+                "jobs": [job.status(now) for job in self.jobs.values()],
+            }
+
+    def runForever(self):
+        while not self.stopping.wait(TICK):
+            self.tick(time.time())
+
+    def shutdown(self, grace=SHUTDOWN_GRACE):
+        """Stop scheduling, cancel API work and wait for running jobs."""
+        self.stopping.set()
+        rate_limiter.cancel()
+        deadline = time.time() + grace
+        for job in list(self.jobs.values()):
+            if job.thread is not None:
+                job.thread.join(max(0.0, deadline - time.time()))
+        self.tick(time.time())
+
+
+class StatusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scheduler):
+        super().__init__(address, StatusHandler)
+        self.scheduler = scheduler
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def sendJson(self, status, body):
+        payload = json.dumps(body, indent=2).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path in ("/", "/status"):
+            self.sendJson(200, self.server.scheduler.status())
+        elif self.path == "/healthz":
+            self.sendJson(200, {"ok": not self.server.scheduler.stopping.is_set()})
+        else:
+            self.sendJson(404, {"error": f"unknown path {self.path}"})
+
+
+def addArgs(parser):
+    parser.add_argument(
+        "--config", default=DEFAULT_CONFIG_FILE, help="json file of the jobs to run"
+    )
+    parser.add_argument("--status-host", default="127.0.0.1")
+    parser.add_argument(
+        "--status-port",
+        type=int,
+        help="port of the /status endpoint, default: the config's statusPort "
+        + f"or {DEFAULT_STATUS_PORT}, 0 disables it",
+    )
+
+
+@script_log.logsTo("scheduler_daemon.log")
+def main(args):
+    config, specs = loadConfig(args.config)
+    scheduler = Scheduler(specs)
+    port = args.status_port
+    if port is None:
+        port = config.get("statusPort", DEFAULT_STATUS_PORT)
+    if port:
+        server = StatusServer((args.status_host, port), scheduler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(
+            f"status on http://{args.status_host}:{server.server_address[1]}/status"
+        )
+    logger.info(f"scheduling {len(specs)} jobs from {args.config}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stopping.set())
+    try:
+        scheduler.runForever()
+    except KeyboardInterrupt:
+        pass
+    logger.info("stopping")
+    scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run jobs on their schedules in one long-lived process"
+    )
+    addArgs(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,45 @@
+import functools
+import logging
+
+LOGGER_NAME = "my_logger"
+FORMATTER = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+
+
+def getLogger():
+    """
+    The "my_logger" logger shared by the scripts. Its console handler is
+    added once, however many scripts are imported into one process.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        logger.setLevel(logging.DEBUG)
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.DEBUG)
+        console_handler.setFormatter(FORMATTER)
+        logger.addHandler(console_handler)
+    return logger
+
+
+def logsTo(fileName):
+    """
+    Decorator also writing the logger's records to fileName while the
+    function runs, so each script of a chained run keeps its own log file.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            logger = getLogger()
+            file_handler = logging.FileHandler(fileName)
+            file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(FORMATTER)
+            logger.addHandler(file_handler)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                logger.removeHandler(file_handler)
+                file_handler.close()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,171 @@
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Columns read from each snapshot; everything else is skipped by read_csv.
+DIFF_COLUMNS = ["zpid", "price", "homeStatus", "address", "city", "zipcode", "link"]
+IDENTITY_COLUMNS = ["address", "city", "zipcode", "link"]
+OUTPUT_COLUMNS = [
+    "zpid",
+    "changeType",
+    "fromDate",
+    "toDate",
+    "oldPrice",
+    "newPrice",
+    "priceDelta",
+    "priceDeltaPct",
+    "oldStatus",
+    "newStatus",
+] + IDENTITY_COLUMNS
+
+
+def extract_date_from_filename(filename):
+    match = re.search(r"forsale_(\d{2})(\d{2})(\d{2})\.csv$", filename)
+    if match is None:
+        raise ValueError(f"No valid date found in filename {filename}.")
+    year, month, day = match.groups()
+    return f"20{year}-{month}-{day}"
+
+
+def list_snapshots(csv_dir):
+    return sorted(
+        os.path.join(csv_dir, file)
+        for file in os.listdir(csv_dir)
+        if re.fullmatch(r"forsale_\d{6}\.csv", file)
+    )
+
+
+def load_snapshot(csv_file):
+    df = pd.read_csv(
+        csv_file,
+        usecols=lambda column: column in DIFF_COLUMNS,
+        dtype={"zpid": str, "zipcode": str, "homeStatus": str},
+    )
+    for column in DIFF_COLUMNS:
+        if column not in df:
+            df[column] = pd.NA
+    df["price"] = pd.to_numeric(
+        df["price"].astype(str).str.replace(r"[\$,]", "", regex=True),
+        errors="coerce",
+    )
+    return df[DIFF_COLUMNS].drop_duplicates("zpid", keep="last")
+
+
+def diff_snapshots(old_df, new_df, from_date=None, to_date=None):
+    """
+    Join two snapshots on zpid and return one row per change: "new" and
+    "removed" listings, "status_changed" when a known homeStatus differs and
+    "price_changed" when both prices are known and differ. A listing whose
+    status and price both changed gets one row of each type.
+    """
+    merged = old_df.merge(
+        new_df, on="zpid", how="outer", suffixes=("_old", "_new"), indicator=True
+    )
+    old_status = merged["homeStatus_old"].fillna("").to_numpy(dtype=str)
+    new_status = merged["homeStatus_new"].fillna("").to_numpy(dtype=str)
+    old_price = merged["price_old"].to_numpy(dtype=float)
+    new_price = merged["price_new"].to_numpy(dtype=float)
+    in_both = (merged["_merge"] == "both").to_numpy()
+
+    masks = {
+        "new": (merged["_merge"] == "right_only").to_numpy(),
+        "removed": (merged["_merge"] == "left_only").to_numpy(),
+        # Snapshots without a homeStatus column (basic mode) never count as a
+        # status change.
+        "status_changed": in_both
+        & (old_status != "")
+        & (new_status != "")
+        & (old_status != new_status),
+        "price_changed": in_both
+        & ~np.isnan(old_price)
+        & ~np.isnan(new_price)
+        & (old_price != new_price),
+    }
+
+    result = pd.DataFrame(
+        {
+            "zpid": merged["zpid"],
+            "fromDate": from_date,
+            "toDate": to_date,
+            "oldPrice": old_price,
+            "newPrice": new_price,
+            "priceDelta": new_price - old_price,
+            "oldStatus": merged["homeStatus_old"],
+            "newStatus": merged["homeStatus_new"],
+        }
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result["priceDeltaPct"] = np.round(
+            100 * (new_price - old_price) / old_price, 2
+        )
+    for column in IDENTITY_COLUMNS:
+        result[column] = merged[f"{column}_new"].combine_first(
+            merged[f"{column}_old"]
+        )
+
+    changes = []
+    for change_type, mask in masks.items():
+        if mask.any():
+            changes.append(result[mask].assign(changeType=change_type))
+    if not changes:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    return pd.concat(changes, ignore_index=True)[OUTPUT_COLUMNS]
+
+
+def diff_consecutive(csv_files):
+    """Diff each snapshot against the one before it."""
+    diffs = []
+    previous = None
+    for csv_file in csv_files:
+        current = (extract_date_from_filename(csv_file), load_snapshot(csv_file))
+        if previous is not None:
+            diffs.append(
+                diff_snapshots(previous[1], current[1], previous[0], current[0])
+            )
+        previous = current
+    if not diffs:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    return pd.concat(diffs, ignore_index=True)
+
+
+def main(args):
+    if args.files:
+        csv_files = sorted(args.files, key=extract_date_from_filename)
+    else:
+        csv_files = list_snapshots(args.dir)[-args.last :]
+    if len(csv_files) < 2:
+        print(f"Need at least two snapshots to diff, got {csv_files}")
+        return
+    df = diff_consecutive(csv_files)
+    output_file = args.output
+    if output_file is None:
+        new_date = extract_date_from_filename(csv_files[-1]).replace("-", "")[2:]
+        output_file = f"snapshot_diff_{new_date}.csv"
+    df.to_csv(output_file, index=False)
+    print(df["changeType"].value_counts().to_string())
+    print(f"{output_file} is created.")
+
+
+def addArgs(parser):
+    parser.add_argument("files", nargs="*", help="forsale csv files to diff in order")
+    parser.add_argument("--dir", default=".", help="forsale csv dir")
+    parser.add_argument(
+        "--last",
+        type=int,
+        default=2,
+        help="diff the latest N snapshots in --dir when no files are given",
+    )
+    parser.add_argument("--output", help="output csv file")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find new, removed, status and price changed listings "
+        + "between consecutive forsale snapshots"
+    )
+    addArgs(parser)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,200 @@
+import argparse
+import logging
+import os
+import re
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+except ImportError:  # the CSV outputs keep working without pyarrow
+    pa = None
+
+logger = logging.getLogger("my_logger")
+
+STORE_DIR = "store"
+
+# Columns parsed to numbers; anything that does not parse becomes null.
+FLOAT_COLUMNS = [
+    "price",
+    "pricePerFt",
+    "listingPrice",
+    "livingArea",
+    "lotAreaValue",
+    "zestimate",
+    "rentZestimate",
+    "propertyTaxRate",
+]
+INT_COLUMNS = ["bedrooms", "stories", "yearBuilt"]
+DATE_COLUMNS = ["datePosted", "dateSold"]
+SCHOOL_COLUMNS = ["schoolsE", "schoolsM", "schoolsH"]
+
+SQFT_PER_ACRE = 43560
+
+
+# Datasets crawled over several states (see region_crawl.py) are also
+# partitioned by state, city names repeat across states.
+REGION_DATASETS = ["region_forsale", "region_sold"]
+
+
+def partitionColumns(dataset):
+    if dataset in REGION_DATASETS:
+        return ["collectedDate", "state", "city"]
+    return ["collectedDate", "city"]
+
+
+def _partitioning(dataset):
+    return ds.partitioning(
+        pa.schema([(column, pa.string()) for column in partitionColumns(dataset)]),
+        flavor="hive",
+    )
+
+
+def datasetPath(dataset, storeDir=STORE_DIR):
+    return os.path.join(storeDir, dataset)
+
+
+def parseLotSize(lotSize):
+    """Convert strings like "2.04 Acres" or "7,405 sqft" to square feet."""
+    parts = lotSize.astype("string").str.extract(
+        r"([\d,.]+)\s*(acres?|sqft)", flags=re.IGNORECASE
+    )
+    value = pd.to_numeric(parts[0].str.replace(",", ""), errors="coerce")
+    isAcres = parts[1].str.lower().str.startswith("acre").fillna(False)
+    return value.where(~isAcres, value * SQFT_PER_ACRE).astype("float64")
+
+
+def parseDates(values):
+    """Dates arrive as "YYYY-MM-DD" strings or as epoch milliseconds."""
+    epochMs = pd.to_numeric(values, errors="coerce")
+    parsed = pd.to_datetime(values.where(epochMs.isna()), errors="coerce")
+    return parsed.fillna(pd.to_datetime(epochMs, unit="ms"))
+
+
+def toTypedFrame(df):
+    """Give a raw snapshot frame (everything read as strings) proper column types."""
+    df = df.copy()
+    for column in FLOAT_COLUMNS:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+    for column in INT_COLUMNS:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors="coerce").round().astype(
+                "Int64"
+            )
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = parseDates(df[column])
+    if "lotSize" in df:
+        df["lotSizeSqft"] = parseLotSize(df["lotSize"])
+    for column in SCHOOL_COLUMNS:
+        if column in df:
+            # "9,Mission San Jose High School" -> rating 9
+            df[f"{column}Rating"] = pd.to_numeric(
+                df[column].astype("string").str.split(",", n=1).str[0],
+                errors="coerce",
+            ).astype("Int64")
+    for column in ["zpid", "zipcode"]:
+        if column in df:
+            df[column] = df[column].astype("string")
+    return df
+
+
+def writeSnapshot(dataset, df, collectedDate, storeDir=STORE_DIR):
+    """
+    Write one day of rows to store/<dataset>/collectedDate=<date>/city=<city>/
+    as uncompressed Arrow IPC (Feather v2) files, replacing that day's
+    partitions if they already exist.
+    """
+    if pa is None:
+        logger.warning("pyarrow is not installed, skip writing the snapshot store")
+        return None
+    df = toTypedFrame(df)
+    df["collectedDate"] = collectedDate
+    for column in partitionColumns(dataset)[1:]:
+        df[column] = df[column].astype("string").fillna("")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    path = datasetPath(dataset, storeDir)
+    ds.write_dataset(
+        table,
+        path,
+        format="feather",
+        partitioning=_partitioning(dataset),
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.arrow",
+    )
+    logger.info(f"{len(df)} rows written to {path} for {collectedDate}")
+    return path
+
+
+def writeSnapshotFromCsv(dataset, csvFile, collectedDate, storeDir=STORE_DIR):
+    df = pd.read_csv(csvFile, dtype=str, keep_default_na=False, na_values=[""])
+    return writeSnapshot(dataset, df, collectedDate, storeDir)
+
+
+def loadSnapshots(
+    dataset,
+    columns=None,
+    dateFrom=None,
+    dateTo=None,
+    cities=None,
+    storeDir=STORE_DIR,
+    states=None,
+):
+    """
+    Read a dataset from the store, touching only the requested columns and
+    the partitions that match the date range and cities. Files are memory
+    mapped, so nothing is copied until pandas needs it.
+    """
+    if pa is None:
+        raise Exception("pyarrow is required to read the snapshot store")
+    dataset = ds.dataset(
+        datasetPath(dataset, storeDir),
+        format="feather",
+        partitioning=_partitioning(dataset),
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+    filters = []
+    if dateFrom is not None:
+        filters.append(ds.field("collectedDate") >= dateFrom)
+    if dateTo is not None:
+        filters.append(ds.field("collectedDate") <= dateTo)
+    if cities is not None:
+        filters.append(ds.field("city").isin(list(cities)))
+    if states is not None:
+        filters.append(ds.field("state").isin(list(states)))
+    rowFilter = None
+    for condition in filters:
+        rowFilter = condition if rowFilter is None else rowFilter & condition
+    return dataset.to_table(columns=columns, filter=rowFilter).to_pandas()
+
+
+def extractCollectedDate(filename):
+    match = re.search(r"_(\d{2})(\d{2})(\d{2})(?:_basic)?\.csv$", filename)
+    if match is None:
+        raise ValueError(f"No valid date found in filename {filename}.")
+    year, month, day = match.groups()
+    return f"20{year}-{month}-{day}"
+
+
+def main(args):
+    for csvFile in args.files:
+        path = writeSnapshotFromCsv(
+            args.dataset, csvFile, extractCollectedDate(csvFile), args.store
+        )
+        print(f"{csvFile} is imported into {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import existing CSV snapshots into the columnar store"
+    )
+    parser.add_argument(
+        "--dataset", required=True, help="[forsale|sold|region_forsale|region_sold]"
+    )
+    parser.add_argument("--store", default=STORE_DIR, help="store directory")
+    parser.add_argument("files", nargs="+", help="snapshot csv files")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,304 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import profiler
+import script_log
+
+logger = script_log.getLogger()
+
+BUCKET_NAME = "dreamhome1029"
+DEFAULT_DEST = f"gs://{BUCKET_NAME}"
+DEFAULT_WORKERS = 4
+# Resumable uploads go in chunks of this size; a failed chunk is retried
+# from the last one GCS committed. Must be a multiple of 256 KiB.
+CHUNK_SIZE = 8 * 1024 * 1024
+# Blob metadata key holding the MD5 of the uncompressed source file, so
+# gzip-encoded blobs can be compared with the local file.
+SOURCE_MD5_KEY = "sourceMd5"
+CONTENT_TYPES = {".csv": "text/csv", ".json": "application/json"}
+
+
+def fileDigests(path):
+    """(base64 MD5, base64 CRC32C or None) of a file, the encoding GCS reports."""
+    md5 = hashlib.md5()
+    try:
+        import google_crc32c
+
+        crc = google_crc32c.Checksum()
+    except ImportError:  # installed with google-cloud-storage
+        crc = None
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            md5.update(block)
+            if crc is not None:
+                crc.update(block)
+    return (
+        base64.b64encode(md5.digest()).decode(),
+        base64.b64encode(crc.digest()).decode() if crc is not None else None,
+    )
+
+
+def gzipFile(path, workDir):
+    # mtime=0 keeps the output identical for identical input.
+    gzPath = os.path.join(workDir, os.path.basename(path) + ".gz")
+    with open(path, "rb") as src, open(gzPath, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    return gzPath
+
+
+class GcsBackend:
+    """A GCS bucket, through one storage client shared by every upload."""
+
+    def __init__(self, bucketName=BUCKET_NAME):
+        self.bucketName = bucketName
+        self.lock = threading.Lock()
+        self._bucket = None
+
+    def url(self, name):
+        return f"gs://{self.bucketName}/{name}"
+
+    def bucket(self):
+        with self.lock:
+            if self._bucket is None:
+                # Imported here, it adds ~0.3s to startup and most runs never upload.
+                from google.cloud import storage
+
+                self._bucket = storage.Client().bucket(self.bucketName)
+            return self._bucket
+
+    def stat(self, name):
+        """{sourceMd5, md5, crc32c, generation} of a stored blob, None if missing."""
+        blob = self.bucket().get_blob(name)
+        if blob is None:
+            return None
+        return {
+            "sourceMd5": (blob.metadata or {}).get(SOURCE_MD5_KEY),
+            "md5": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "contentEncoding": blob.content_encoding,
+            "generation": blob.generation,
+        }
+
+    def put(self, name, path, contentType, contentEncoding, sourceMd5, generation):
+        blob = self.bucket().blob(name, chunk_size=CHUNK_SIZE)
+        blob.content_encoding = contentEncoding
+        blob.metadata = {SOURCE_MD5_KEY: sourceMd5}
+        # The generation precondition makes the default retry policy safe and
+        # fails the upload if another writer replaced the blob meanwhile.
+        blob.upload_from_filename(
+            path,
+            content_type=contentType,
+            checksum="crc32c",
+            if_generation_match=generation or 0,
+        )
+
+
+class LocalBackend:
+    """
+    A directory laid out like a bucket, for tests and offline runs. Each
+    object has a <name>.meta.json sidecar with what GCS keeps as metadata;
+    gzip-encoded objects are stored as <name>.gz so they open as what they are.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return self._objectPath(name, (self._meta(name) or {}).get("contentEncoding"))
+
+    def _objectPath(self, name, contentEncoding):
+        path = os.path.join(self.root, name)
+        return f"{path}.gz" if contentEncoding == "gzip" else path
+
+    def _metaPath(self, name):
+        return os.path.join(self.root, f"{name}.meta.json")
+
+    def _meta(self, name):
+        metaPath = self._metaPath(name)
+        if not os.path.isfile(metaPath):
+            return None
+        with open(metaPath) as file:
+            return json.load(file)
+
+    def stat(self, name):
+        meta = self._meta(name)
+        if meta is None:
+            return None
+        objectPath = self._objectPath(name, meta.get("contentEncoding"))
+        if not os.path.isfile(objectPath):
+            return None
+        md5, crc32c = fileDigests(objectPath)
+        return {**meta, "md5": md5, "crc32c": crc32c}
+
+    def put(self, name, path, contentType, contentEncoding, sourceMd5, generation):
+        target = self._objectPath(name, contentEncoding)
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with self.lock:
+            current = self.stat(name)
+            if (current or {}).get("generation") != generation:
+                raise Exception(f"{target} was replaced by another upload")
+            meta = {
+                SOURCE_MD5_KEY: sourceMd5,
+                "contentType": contentType,
+                "contentEncoding": contentEncoding,
+                "generation": (generation or 0) + 1,
+            }
+            shutil.copyfile(path, f"{target}.tmp")
+            os.replace(f"{target}.tmp", target)
+            with open(f"{self._metaPath(name)}.tmp", "w") as file:
+                json.dump(meta, file)
+            os.replace(f"{self._metaPath(name)}.tmp", self._metaPath(name))
+            # Drop the copy stored under the other encoding's name, if any.
+            stale = self._objectPath(name, None if contentEncoding else "gzip")
+            if os.path.isfile(stale):
+                os.remove(stale)
+
+
+def backendFor(dest):
+    """gs://<bucket> or a local directory (optionally file://<dir>)."""
+    if dest.startswith("gs://"):
+        return GcsBackend(dest[len("gs://") :].strip("/"))
+    if dest.startswith("file://"):
+        dest = dest[len("file://") :]
+    return LocalBackend(dest)
+
+
+def isUnchanged(remote, sourceMd5, sourceCrc32c):
+    if remote is None:
+        return False
+    if remote.get("sourceMd5") is not None:
+        return remote["sourceMd5"] == sourceMd5
+    if remote.get("contentEncoding") == "gzip":
+        return False
+    # Uploaded before sourceMd5 was recorded: compare the stored bytes.
+    # Composite objects have no MD5, only a CRC32C.
+    if remote.get("md5") is not None:
+        return remote["md5"] == sourceMd5
+    return sourceCrc32c is not None and remote.get("crc32c") == sourceCrc32c
+
+
+class Uploader:
+    """
+    Upload files to a backend, skipping those whose content already matches
+    the stored object. Files are gzip-encoded on the way (GCS serves them
+    decompressed to clients that do not accept gzip) and sent concurrently.
+    """
+
+    def __init__(self, backend, compress=True, workers=DEFAULT_WORKERS):
+        self.backend = backend
+        self.compress = compress
+        self.workers = workers
+
+    def uploadOne(self, path, name):
+        """Upload path as name; return "uploaded" or "unchanged"."""
+        sourceMd5, sourceCrc32c = fileDigests(path)
+        remote = self.backend.stat(name)
+        if isUnchanged(remote, sourceMd5, sourceCrc32c):
+            logger.info(f"File {path} is unchanged at {self.backend.url(name)}.")
+            return "unchanged"
+        contentType = CONTENT_TYPES.get(
+            os.path.splitext(path)[1], "application/octet-stream"
+        )
+        generation = remote["generation"] if remote is not None else None
+        with tempfile.TemporaryDirectory() as workDir:
+            sendPath = gzipFile(path, workDir) if self.compress else path
+            self.backend.put(
+                name,
+                sendPath,
+                contentType,
+                "gzip" if self.compress else None,
+                sourceMd5,
+                generation,
+            )
+        logger.info(f"File {path} uploaded to {self.backend.url(name)}.")
+        return "uploaded"
+
+    def uploadAll(self, jobs):
+        """jobs: (path, name) pairs. Return {name: "uploaded"|"unchanged"}."""
+        jobs = list(jobs)
+        with profiler.span("upload", files=len(jobs)):
+            if len(jobs) <= 1 or self.workers <= 1:
+                results = [self.uploadOne(path, name) for path, name in jobs]
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    results = list(
+                        executor.map(lambda job: self.uploadOne(*job), jobs)
+                    )
+        return {name: result for (_, name), result in zip(jobs, results)}
+
+
+_uploader = None
+# Backends by destination, so repeated runs in one process (the scheduler
+# daemon) keep their storage client.
+_backends = {}
+
+
+def configure(dest=DEFAULT_DEST, compress=True, workers=DEFAULT_WORKERS):
+    global _uploader
+    if dest not in _backends:
+        _backends[dest] = backendFor(dest)
+    _uploader = Uploader(_backends[dest], compress, workers)
+    return _uploader
+
+
+def uploadFiles(jobs):
+    """Upload (path, name) pairs with the configured uploader, default GCS."""
+    if _uploader is None:
+        configure()
+    return _uploader.uploadAll(jobs)
+
+
+def addUploadArgs(parser):
+    parser.add_argument(
+        "--upload-dest",
+        default=os.environ.get("DREAMHOUSE_UPLOAD_DEST", DEFAULT_DEST),
+        help="gs://<bucket> or a local directory standing in for one",
+    )
+    parser.add_argument(
+        "--no-gzip", action="store_true", help="upload files without gzip encoding"
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="files uploaded at the same time",
+    )
+
+
+def configureFromArgs(args):
+    return configure(args.upload_dest, not args.no_gzip, args.upload_workers)
+
+
+def addArgs(parser):
+    parser.add_argument("files", nargs="+", help="files to upload")
+    parser.add_argument(
+        "--blob", help="destination name of a single file, default: its file name"
+    )
+    addUploadArgs(parser)
+
+
+@script_log.logsTo("uploader.log")
+def main(args):
+    if args.blob and len(args.files) > 1:
+        raise Exception("--blob needs exactly one file")
+    configureFromArgs(args)
+    uploadFiles(
+        (path, args.blob or os.path.basename(path)) for path in args.files
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload files to GCS")
+    addArgs(parser)
+    args = parser.parse_args()
+    main(args)